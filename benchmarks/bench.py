@@ -0,0 +1,172 @@
+'''
+Times the stages of the parser on synthetic data (see bmt_parser.synthetic)
+at several scales and stores the results as json, so that runs can be
+compared.
+
+Timed stages:
+
+ - parse_xml.get_issue, for every alto engine (all issues of the corpus)
+ - parse_mets.main, for every mets engine
+ - disambiguate_names.main, on the parsed data
+ - collaborators.get_collaborators, on the disambiguated data
+
+Run from the repository root:
+
+    python3 -m benchmarks.bench --scales small medium -o bench.json
+    python3 -m benchmarks.bench --scales small --compare bench.json
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import bmt_parser.collaborators as collaborators
+import bmt_parser.disambiguate_names as disambiguate
+import bmt_parser.parse_alto as parse_alto
+import bmt_parser.parse_mets as parse_mets
+import bmt_parser.parse_xml as parse_xml
+import bmt_parser.synthetic as synthetic
+
+
+# arguments for synthetic.generate
+SCALES = {
+    'small': {'issues': 10, 'sections': 10, 'pages': 4, 'blocks': 20,
+              'authors': 100},
+    'medium': {'issues': 50, 'sections': 20, 'pages': 8, 'blocks': 30,
+               'authors': 500},
+    'large': {'issues': 200, 'sections': 40, 'pages': 12, 'blocks': 40,
+              'authors': 2000},
+}
+
+
+def run(scales, repeat=3, hyphenation=0.1):
+    '''returns the benchmark results as a dict'''
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'scales': {}
+    }
+
+    for scale in scales:
+        params = dict(SCALES[scale], hyphenation=hyphenation)
+        tmp = tempfile.mkdtemp(prefix='bmt_bench_')
+        try:
+            paths = synthetic.generate(tmp, **params)
+            results['scales'][scale] = {
+                'params': params,
+                'stages': _run_scale(paths, tmp, repeat)}
+        finally:
+            shutil.rmtree(tmp)
+
+    return results
+
+
+def _run_scale(paths, tmp, repeat):
+    stages = {}
+    tasks = parse_xml._get_tasks(paths['issues'], 'bs4')
+
+    for engine in parse_alto.ENGINES:
+        def parse():
+            return [parse_xml.get_issue(mets_path, alto_dir, issue_id,
+                                        engine)
+                    for mets_path, alto_dir, issue_id, *_ in tasks]
+        seconds, result = _time(parse, repeat)
+        stages['get_issue_' + engine] = {
+            'seconds': seconds,
+            'issues': len(tasks),
+            'sections': sum(len(r) for r in result if r)}
+
+    for engine in parse_mets.ENGINES:
+        def parse():
+            return [parse_mets.main(mets_path, engine=engine)
+                    for mets_path, *_ in tasks]
+        seconds, result = _time(parse, repeat)
+        stages['parse_mets_' + engine] = {
+            'seconds': seconds,
+            'sections': sum(len(r.sections) for r in result)}
+
+    data_path = os.path.join(tmp, 'data.csv')
+    parse_xml.main(paths['issues'], data_path)
+
+    seconds, data = _time(lambda: disambiguate.main(
+        paths['disambiguation'], data_path, None), repeat)
+    stages['disambiguate_names'] = {'seconds': seconds, 'rows': len(data)}
+
+    seconds, collabs = _time(
+        lambda: collaborators.get_collaborators(data), repeat)
+    stages['get_collaborators'] = {'seconds': seconds, 'pairs': len(collabs)}
+
+    return stages
+
+
+def _time(func, repeat):
+    '''returns the best time out of repeat runs and the result of the last'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    '''returns lines comparing the stage times of two result dicts'''
+    lines = []
+    for scale, data in new['scales'].items():
+        if scale not in old['scales']:
+            continue
+        for stage, values in data['stages'].items():
+            before = old['scales'][scale]['stages'].get(stage)
+            if not before:
+                continue
+            ratio = values['seconds'] / before['seconds']
+            lines.append('{:8} {:22} {:9.3f}s -> {:9.3f}s  x{:.2f}'.format(
+                scale, stage, before['seconds'], values['seconds'], ratio))
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmarks the parser '
+                                     'stages on synthetic data')
+    parser.add_argument('--scales', nargs='+', default=['small'],
+                        choices=list(SCALES.keys()))
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='runs per stage, the best time is kept')
+    parser.add_argument('--hyphenation', type=float, default=0.1,
+                        help='share of hyphenated words')
+    parser.add_argument('--output', '-o', required=False,
+                        help='path of the json file for the results')
+    parser.add_argument('--compare', '-c', required=False,
+                        help='json file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = run(args.scales, args.repeat, args.hyphenation)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print('\n'.join(compare(json.load(f), results)))
@@ -0,0 +1,9 @@
+'''
+Runs the command line, see the cli module:
+
+    python3 -m bmt_parser -h
+'''
+
+from bmt_parser.cli import main
+
+main()
@@ -0,0 +1,230 @@
+'''
+Reads the issues of a periodical from a zip or tar archive of its data dir
+(compressed or not), without extracting it.
+
+Files in an archive have the path of the archive joined with their name in
+the archive, for example "bmtnaap.tar.gz/bmtnaap/issues/1910/01/alto". These
+paths are used in the output and in the logs like the paths of extracted
+files.
+
+The members of an archive are indexed once when it is opened, and all
+files are then read with the index. Members of zip files and uncompressed
+tars are read directly. A compressed tar has no index of its members, so
+indexing it decompresses the archive once; after that it can only be read
+forward without decompressing it again, so the issues are read in a single
+pass over the archive. To keep few files in memory during that pass, issues
+are ordered by the position of their last file in the archive.
+'''
+
+import logging
+import os
+import posixpath
+import re
+import tarfile
+import zipfile
+import bmt_parser.diagnostics as diagnostics
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_archive(path):
+    '''returns True if path is a zip or tar file'''
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or
+                                     tarfile.is_tarfile(path))
+
+
+def split_path(path):
+    '''returns (path of the archive, name in the archive) for a path inside
+    an archive, or None if the path is not inside an archive
+    '''
+    head, name = path, ''
+    while head and not os.path.exists(head):
+        head, tail = os.path.split(head)
+        if not tail:
+            break
+        name = posixpath.join(tail, name) if name else tail
+    if name and is_archive(head):
+        return head, name
+    return None
+
+
+class Archive(object):
+    '''an opened archive. Use as a context manager:
+
+        with Archive(path) as source:
+            issues = source.find_issues()
+            for issue, files in source.read_issues(issues):
+                ...
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._compressed = False
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            self._tar = None
+            members = [info for info in self._zip.infolist()
+                       if not info.is_dir()]
+            names = [info.filename for info in members]
+        else:
+            self._zip = None
+            try:
+                self._tar = tarfile.open(path, 'r:')
+            except tarfile.ReadError:
+                self._tar = tarfile.open(path, 'r:*')
+                self._compressed = True
+            members = [info for info in self._tar.getmembers()
+                       if info.isfile()]
+            names = [info.name for info in members]
+
+        names = [posixpath.normpath(name) for name in names]
+        self._members = dict(zip(names, members))
+        # position of every file in the archive
+        self._position = {name: i for i, name in enumerate(names)}
+        self._dirs = {}
+        for name in names:
+            self._dirs.setdefault(posixpath.dirname(name), []).append(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+        if self._tar:
+            self._tar.close()
+
+    def find_issues(self):
+        '''returns a list of (mets_path, alto_dir) tuples, one for each issue
+        in the archive, like parse_xml.find_issues
+        '''
+        parents = {posixpath.dirname(d) for d in self._dirs}
+        for d in list(parents):
+            while d:
+                d = posixpath.dirname(d)
+                parents.add(d)
+
+        issues = []
+        for alto_dir in self._dirs:
+            if alto_dir in parents:  # starting at lowest level dir
+                continue
+            if not re.search('alto$', alto_dir):
+                diagnostics.record('no_alto_dir', 'no alto dir in {}',
+                                   self._path(alto_dir))
+                continue
+
+            mets_dir = posixpath.dirname(alto_dir)
+            mets_file = sorted(name for name in self._dirs.get(mets_dir, [])
+                               if re.search(r'mets\.xml$', name))
+            if not mets_file:
+                diagnostics.record('no_mets_file', 'no mets file for {}',
+                                   self._path(mets_dir))
+                continue
+            issues.append((mets_file[0], alto_dir))
+
+        issues.sort(key=lambda issue: max(
+            self._position[name] for name in self._issue_files(*issue)))
+        return [(self._path(mets_path), self._path(alto_dir))
+                for mets_path, alto_dir in issues]
+
+    def signature(self, mets_path, alto_dir):
+        '''returns what identifies the state of the issue files, like
+        cache.signature: (name, size, crc) for zip archives and (name, size,
+        modification time) for tar archives
+        '''
+        result = []
+        for name in self._issue_files(self._name(mets_path),
+                                      self._name(alto_dir)):
+            info = self._members[name]
+            if self._zip:
+                result.append((posixpath.basename(name), info.file_size,
+                               info.CRC))
+            else:
+                result.append((posixpath.basename(name), info.size,
+                               info.mtime))
+        return result
+
+    def listdir(self, path):
+        '''returns the names of the files in a dir of the archive'''
+        return [posixpath.basename(name)
+                for name in self._dirs.get(self._name(path), [])]
+
+    def read_file(self, path):
+        '''returns the bytes of a file in the archive'''
+        return self._read(self._name(path))
+
+    def read_dir(self, path):
+        '''returns a dict {file name: bytes} of the files in a dir of the
+        archive
+        '''
+        return {posixpath.basename(name): self._read(name)
+                for name in self._dirs.get(self._name(path), [])}
+
+    def read_issues(self, issues, alto=True):
+        '''yields (issue, files) for every issue, in order, like
+        prefetch.read_ahead
+
+        @param issues: (mets_path, alto_dir, ...) tuples, from find_issues
+        @param alto: read the alto files. If False, "alto" is None
+        '''
+        if not self._compressed:
+            for issue in issues:
+                yield issue, self.read_issue(issue, alto)
+            return
+
+        # reading the files in the order of the archive, so that the tar is
+        # only read forward, keeping the files of the issues that are not
+        # complete yet
+        issues = list(issues)
+        wanted = {}
+        for i, issue in enumerate(issues):
+            mets_path, alto_dir = issue[:2]
+            wanted[self._name(mets_path)] = (i, None)
+            if alto:
+                for name in self._dirs[self._name(alto_dir)]:
+                    wanted[name] = (i, posixpath.basename(name))
+        remaining = [0] * len(issues)
+        for i, _ in wanted.values():
+            remaining[i] += 1
+        files = [{'mets': None, 'alto': {} if alto else None}
+                 for _ in issues]
+
+        current = 0
+        for name in sorted(wanted, key=self._position.get):
+            i, alto_name = wanted[name]
+            data = self._read(name)
+            if alto_name is None:
+                files[i]['mets'] = data
+            else:
+                files[i]['alto'][alto_name] = data
+            remaining[i] -= 1
+
+            while current < len(issues) and not remaining[current]:
+                yield issues[current], files[current]
+                files[current] = None
+                current += 1
+
+    def read_issue(self, issue, alto=True):
+        '''returns the files of an issue, like read_issues'''
+        mets_path, alto_dir = issue[:2]
+        return {'mets': self._read(self._name(mets_path)),
+                'alto': self.read_dir(alto_dir) if alto else None}
+
+    def _read(self, name):
+        if self._zip:
+            return self._zip.read(self._members[name])
+        return self._tar.extractfile(self._members[name]).read()
+
+    def _issue_files(self, mets_name, alto_dir):
+        return [mets_name] + self._dirs[alto_dir]
+
+    def _path(self, name):
+        return os.path.join(self.path, name)
+
+    def _name(self, path):
+        return posixpath.normpath(os.path.relpath(path, self.path)
+                                  .replace(os.sep, '/'))
@@ -0,0 +1,133 @@
+'''
+A cache of parsed issues, so that a rerun only parses new or changed issues.
+
+Every issue is stored in its own file in the cache dir, named after a hash of
+the mets path. An entry is used only when
+
+ - the mets file and the files in the alto dir did not change (same size and
+   modification time, or the same content if hashing is on)
+ - it was written by the same version of the parser, see parser_version()
+
+Call clear() to remove all entries.
+'''
+
+import hashlib
+import os
+import pickle
+import bmt_parser.parse_mets as mets
+
+
+# modules whose source code is part of the parser version
+PARSER_MODULES = ['parse_mets', 'parse_mets_lxml', 'parse_alto', 'parse_xml',
+                  'records']
+
+_version = None
+
+
+def parser_version():
+    '''returns a hash of the parser source code and of the section settings
+    in parse_mets (KNOWN_SUBS, RELEVANT_SUBS, VALID_SECTIONS). Entries from
+    another parser version are not used.
+    '''
+    global _version
+    if _version is None:
+        h = hashlib.sha1()
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for module in PARSER_MODULES:
+            with open(os.path.join(package_dir, module + '.py'), 'rb') as f:
+                h.update(f.read())
+        h.update(repr((mets.KNOWN_SUBS, mets.RELEVANT_SUBS,
+                       mets.VALID_SECTIONS)).encode('utf-8'))
+        _version = h.hexdigest()
+    return _version
+
+
+def signature(mets_path, alto_dir, hash_files=False):
+    '''returns what identifies the state of the issue files: a list with
+    (name, size, modification time) for the mets file and every file in the
+    alto dir, or (name, sha1 of the content) if hash_files is True. Returns
+    None if the files cannot be read: the issue is not cached, and parsing
+    it reports the error
+    '''
+    try:
+        paths = [mets_path] + [os.path.join(alto_dir, name)
+                               for name in sorted(os.listdir(alto_dir))]
+        result = []
+        for path in paths:
+            name = os.path.basename(path)
+            if hash_files:
+                with open(path, 'rb') as f:
+                    result.append((name,
+                                   hashlib.sha1(f.read()).hexdigest()))
+            else:
+                stat = os.stat(path)
+                result.append((name, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        return None
+    return result
+
+
+def is_valid(cache_dir, mets_path, sig):
+    '''returns True if there is a usable entry for the issue'''
+    if sig is None:
+        return False
+    header = _read(cache_dir, mets_path, header_only=True)
+    return header is not None and _header(mets_path, sig) == header
+
+
+def get(cache_dir, mets_path, sig):
+    '''returns the cached sections of an issue, or None if there is no usable
+    entry
+    '''
+    entry = _read(cache_dir, mets_path)
+    if entry is None or entry[0] != _header(mets_path, sig):
+        return None
+    return entry[1]
+
+
+def put(cache_dir, mets_path, sig, sections):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, mets_path)
+    # writing to a temporary file first so an interrupted run does not leave
+    # a broken entry
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(_header(mets_path, sig), f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(sections, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def clear(cache_dir):
+    '''removes all entries from the cache dir and its subdirs'''
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for name in filenames:
+            if name.endswith('.pickle') or name.endswith('.pickle.tmp'):
+                os.remove(os.path.join(dirpath, name))
+
+
+def _header(mets_path, sig):
+    return {'version': parser_version(),
+            'mets_path': os.path.abspath(mets_path),
+            'signature': sig}
+
+
+def _entry_path(cache_dir, mets_path):
+    key = hashlib.sha1(os.path.abspath(mets_path).encode('utf-8'))
+    return os.path.join(cache_dir, key.hexdigest() + '.pickle')
+
+
+def _read(cache_dir, mets_path, header_only=False):
+    '''returns (header, sections), only the header if header_only, or None if
+    there is no readable entry
+    '''
+    path = _entry_path(cache_dir, mets_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header_only:
+                return header
+            return header, pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
@@ -0,0 +1,396 @@
+'''
+The command line of the package, run with "python3 -m bmt_parser". The
+stages have their own subcommands:
+
+ - parse: parses the xml using mets and alto files
+ - disambiguate: disambiguates names in the parsed data
+ - graph: transforms the data into a suitable format for drawing graphs
+ - run: any of the stages above in one go, handing the data from one stage
+   to the next (the options of bmt_parser.main)
+
+Only the modules needed by the chosen subcommand are imported, after the
+arguments were parsed: "-h" does not import pandas, and "graph" does not
+import the xml parsers. The time taken until the stage starts is logged and
+is the "startup" stage of the metrics.
+
+Uses logging, logs to "parse.log" in root. It will empty the log at start.
+The handlers are attached to the logger of the package by configure_logging,
+the modules only get their loggers.
+'''
+
+import argparse
+import importlib
+import logging
+import os
+import time
+import bmt_parser.config as cf
+import bmt_parser.diagnostics as diagnostics
+import bmt_parser.metrics as metrics
+
+_started = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+# modules imported by every subcommand
+MODULES = {
+    'parse': ['bmt_parser.parse_xml'],
+    'disambiguate': ['bmt_parser.disambiguate_names'],
+    'graph': ['bmt_parser.collaborators'],
+    'run': ['bmt_parser.parse_xml', 'bmt_parser.disambiguate_names',
+            'bmt_parser.collaborators']
+}
+
+
+def main(argv=None):
+    '''runs the command line with the arguments in argv (default: the
+    arguments of the script)
+    '''
+    args = get_parser().parse_args(argv)
+    configure_logging()
+
+    with metrics.stage('startup'):
+        for module in MODULES[args.command]:
+            importlib.import_module(module)
+    logger.info('started in %.3f s', time.perf_counter() - _started)
+
+    diagnostics.configure(args.quiet, cf.DIAGNOSTICS_RECORDS)
+
+    # creating output dir if it does not exist
+    if not os.path.exists(cf.OUTPUT_DIR):
+        os.makedirs(cf.OUTPUT_DIR)
+    paths = _get_paths(args.periodical_name, args.data_format)
+
+    if args.command == 'run':
+        data = None
+        if args.xml_data_path:
+            data = _parse(args, paths)
+        if args.disambiguation_file:
+            data = _disambiguate(args, paths, data)
+        if args.tf_for_graph:
+            _graph(args, paths, data)
+    elif args.command == 'parse':
+        _parse(args, paths)
+    elif args.command == 'disambiguate':
+        _disambiguate(args, paths)
+    else:
+        _graph(args, paths)
+
+    # the stages logged the summary of their diagnostics
+    if args.diagnostics:
+        diagnostics.write(args.diagnostics)
+
+    if args.metrics:
+        metrics.write(args.metrics, cf.SLOWEST_ISSUES)
+
+
+def configure_logging(path='parse.log'):
+    '''empties the log at path and attaches the handlers to the logger of
+    the package, once: everything is logged to stderr, warnings and errors
+    also to the log
+    '''
+    open(path, 'w').close()  # emptying log
+    package_logger = logging.getLogger('bmt_parser')
+    if package_logger.handlers:
+        return
+    package_logger.setLevel(logging.DEBUG)
+    package_logger.addHandler(logging.StreamHandler())
+
+    file_handler = logging.FileHandler(path, delay=True)
+    file_handler.setLevel(logging.WARNING)
+    package_logger.addHandler(file_handler)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='bmt_parser',
+        description='A script for parsing Blue Mountain periodicals data '
+        'https://github.com/pulibrary/BlueMountain. You first need to '
+        'download the data using the provided bash script. Outputs will be '
+        'stored in paths as provided in config.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    _add_common_arguments(common)
+
+    command = commands.add_parser(
+        'parse', parents=[common], help='parse the xml data into the data '
+        'table')
+    _add_parse_arguments(command, required=True)
+
+    command = commands.add_parser(
+        'disambiguate', parents=[common], help='disambiguate the authors of '
+        'the data table into the disambiguated table')
+    _add_disambiguation_arguments(command, required=True)
+
+    command = commands.add_parser(
+        'graph', parents=[common], help='transform the disambiguated table '
+        '(or the data table if there is none) for drawing graphs')
+    _add_graph_arguments(command)
+
+    command = commands.add_parser(
+        'run', parents=[common], help='run the stages given by the options '
+        'in one go')
+    _add_parse_arguments(command, required=False)
+    _add_disambiguation_arguments(command, required=False)
+    _add_graph_arguments(command)
+    _add_run_arguments(command)
+
+    return parser
+
+
+def _add_common_arguments(parser):
+    parser.add_argument('--periodical_name', '-name', required=False,
+                        help='name of the periodical you wish to parse. Will '
+                        'be used for naming output')
+
+    parser.add_argument('--data_format', '-df', required=False,
+                        default=cf.DATA_FORMAT, choices=cf.DATA_FORMATS,
+                        help='format of the data, disambiguated data and '
+                        'collaborators tables. "csv" is tab separated text, '
+                        '"parquet" and "feather" are typed columnar formats '
+                        'that are faster to read and need the pyarrow '
+                        'library')
+
+    parser.add_argument('--metrics', '-m', required=False, help='path of a '
+                        'json file where to write metrics of the run: time '
+                        'per stage, bytes read, number of issues, sections '
+                        'and authors, peak memory and the slowest issues')
+
+    parser.add_argument('--diagnostics', required=False, help='path of a '
+                        'json file where to write the problems found in the '
+                        'data (ignored sections, names without a '
+                        'disambiguation...), counted and with up to '
+                        'config.DIAGNOSTICS_RECORDS examples per kind of '
+                        'problem')
+
+    parser.add_argument('--quiet', '-q', required=False, default=False,
+                        action='store_true', help='Flag whether to only count '
+                        'the problems found in the data, without keeping '
+                        'examples')
+
+
+def _add_parse_arguments(parser, required):
+    parser.add_argument('--xml_data_path', '-xml', required=required,
+                        help='dir where the Blue Mountain data is located, or '
+                        'a zip or tar archive of it.' + ('' if required else
+                        ' If not provided, no parsing will be done (a lengthy '
+                        'process, you probably want to skip this after the '
+                        'first time)'))
+
+    parser.add_argument('--alto_engine', '-alto', required=False,
+                        default='bs4', choices=cf.ALTO_ENGINES,
+                        help='engine for reading the alto files: "bs4" loads '
+                        'every page into BeautifulSoup, "lxml" streams each '
+                        'page and keeps only the needed text blocks (faster, '
+                        'same output)')
+
+    parser.add_argument('--mets_engine', '-mets', required=False,
+                        default='bs4', choices=cf.METS_ENGINES,
+                        help='engine for parsing the mets files: "bs4" uses '
+                        'BeautifulSoup, "lxml" compiled XPath expressions '
+                        '(faster, same output)')
+
+    parser.add_argument('--references', '-ref', required=False,
+                        default=False, action='store_true', help='Flag '
+                        'whether to store the alto locations of the Head, '
+                        'Subhead, Byline and Copy texts instead of the texts. '
+                        'The alto files are not read, and the text can be '
+                        'loaded later with parse_xml.load_text')
+
+    parser.add_argument('--workers', '-w', required=False, default=1,
+                        type=int, help='number of processes used for parsing '
+                        'the xml. The output does not depend on the number '
+                        'of workers')
+
+    parser.add_argument('--read_ahead', '-ra', required=False,
+                        default=cf.READ_AHEAD, type=int, help='number of '
+                        'issues whose files are read in the background while '
+                        'an issue is parsed, 0 to disable. Helps on slow or '
+                        'network storage. Only used with one worker')
+
+    parser.add_argument('--read_ahead_mb', required=False,
+                        default=cf.READ_AHEAD_BYTES // 2**20, type=int,
+                        help='maximum size in megabytes of the files read '
+                        'ahead')
+
+    parser.add_argument('--cache', required=False, default=False,
+                        action='store_true', help='Flag whether to cache '
+                        'parsed issues in {}. Only new or changed issues will '
+                        'be parsed again. The cache is not used when the '
+                        'parser code changes'.format(cf.CACHE_DIR))
+
+    parser.add_argument('--hash_files', required=False, default=False,
+                        action='store_true', help='Flag whether to detect '
+                        'changed issue files by their content (slower) '
+                        'instead of size and modification time')
+
+    parser.add_argument('--clear_cache', required=False, default=False,
+                        action='store_true', help='Flag whether to empty the '
+                        'cache of parsed issues before parsing')
+
+
+def _add_disambiguation_arguments(parser, required):
+    parser.add_argument('--disambiguation_file', '-d', required=required,
+                        help='path to csv with disambiguations, needs to be '
+                        'tab delimited (Blue Mountain provides an Excel file '
+                        'so you will need to convert.' + ('' if required else
+                        ' If not provided, no disambiguation will be done.'))
+
+    parser.add_argument('--name_replacements', '-repl', required=False,
+                        help='Optional: path to json that has replacements '
+                        'for the resolved name ("Unique Names") column in the '
+                        'disambiguation file')
+
+    parser.add_argument('--match_threshold', required=False, default=None,
+                        nargs='?', const=cf.NAME_MATCH_THRESHOLD, type=float,
+                        help='Optional: names of the data that are not in the '
+                        'disambiguation file get the resolved name of the '
+                        'most similar name in the file as a proposal if their '
+                        'similarity (0 to 1) is at least this ({} if no '
+                        'value is given). The proposals are in the '
+                        'diagnostics and in --store_disamb'.format(
+                            cf.NAME_MATCH_THRESHOLD))
+
+    parser.add_argument('--apply_name_matches', required=False,
+                        default=False, action='store_true', help='Flag '
+                        'whether to use the proposals as the resolved names. '
+                        'Makes the proposals if --match_threshold is not '
+                        'given')
+
+    parser.add_argument('--resolve_initials', required=False, default=False,
+                        action='store_true', help='Flag whether to replace '
+                        'found names that are initials (like "H. W.") and '
+                        'have no resolved name with the full name that has '
+                        'these initials, if there is only one')
+
+    parser.add_argument('--store_disamb', '-sd', required=False,
+                        help='Optional: path where to store the corrected '
+                        'disambiguation table, with the proposals')
+
+
+def _add_graph_arguments(parser):
+    parser.add_argument('--graph_format', '-gf', required=False,
+                        default='csv', choices=cf.GRAPH_FORMATS,
+                        help='output of the graph transformation: "csv" is a '
+                        'table of author pairs and their count, "npz" is a '
+                        'sparse co-authorship matrix with an author '
+                        'dictionary, "both" writes both')
+
+
+def _add_run_arguments(parser):
+    parser.add_argument('--tf_for_graph', '-graph', required=False,
+                        default=False, action='store_true', help='Flag '
+                        'whether to transform data for displaying it as a '
+                        'graph. Will try to find data in paths as defined in '
+                        'config.py.')
+
+    parser.add_argument('--in_memory', '-mem', required=False, default=False,
+                        action='store_true', help='Flag whether to hand the '
+                        'data from one stage to the next in memory. The '
+                        'parsed and disambiguated data are then only written '
+                        'with --write_intermediate')
+
+    parser.add_argument('--write_intermediate', required=False,
+                        default=False, action='store_true', help='Flag '
+                        'whether to write the parsed and disambiguated data '
+                        'when running with --in_memory')
+
+
+def _get_paths(periodical_name, data_format):
+    '''returns the output paths, see config.PATHS'''
+    if periodical_name:
+        paths = {
+            key: os.path.join(cf.OUTPUT_DIR,
+                              '_'.join([periodical_name, cf.PATHS[key]]))
+            for key in cf.PATHS.keys()}
+    else:
+        paths = {
+            key: os.path.join(cf.OUTPUT_DIR, cf.PATHS[key])
+            for key in cf.PATHS.keys()}
+
+    # tables are stored in the chosen data format
+    for key in ['data', 'disamb', 'collabs']:
+        paths[key] = os.path.splitext(paths[key])[0] + '.' + data_format
+    return paths
+
+
+def _in_memory(args):
+    return args.command == 'run' and args.in_memory
+
+
+def _write_intermediate(args):
+    return not _in_memory(args) or args.write_intermediate
+
+
+def _parse(args, paths):
+    '''parses the xml. Returns the data if it is handed over in memory'''
+    import bmt_parser.cache as cache
+    import bmt_parser.parse_xml as parse_xml
+    import bmt_parser.storage as storage
+
+    if args.clear_cache:
+        cache.clear(cf.CACHE_DIR)
+
+    text_mode = 'references' if args.references else 'text'
+    cache_dir = cf.CACHE_DIR if args.cache else None
+    read_ahead_bytes = args.read_ahead_mb * 2**20
+
+    if not _in_memory(args):
+        parse_xml.main(args.xml_data_path, paths['data'], args.alto_engine,
+                       args.workers, cache_dir, args.hash_files,
+                       args.data_format, text_mode, args.read_ahead,
+                       read_ahead_bytes, args.mets_engine)
+        return None
+
+    data = parse_xml.get_data(args.xml_data_path, args.alto_engine,
+                              args.workers, cache_dir, args.hash_files,
+                              text_mode, args.read_ahead, read_ahead_bytes,
+                              args.mets_engine)
+    if args.write_intermediate:
+        # the same file as written by parse_xml.main
+        storage.write_rows(data, paths['data'], args.data_format)
+    return data
+
+
+def _disambiguate(args, paths, data=None):
+    '''disambiguates the parsed data. Returns the disambiguated data'''
+    import bmt_parser.disambiguate_names as disambiguate
+    import bmt_parser.storage as storage
+
+    if data is None:
+        data = storage.read(paths['data'], args.data_format)
+    data = disambiguate.disambiguate_data(data, args.disambiguation_file,
+                                          args.name_replacements,
+                                          args.store_disamb,
+                                          args.match_threshold,
+                                          args.apply_name_matches,
+                                          args.resolve_initials)
+    if _write_intermediate(args):
+        storage.write(data, paths['disamb'], args.data_format)
+    return data
+
+
+def _graph(args, paths, data=None):
+    import bmt_parser.collaborators as for_graph
+    import bmt_parser.storage as storage
+
+    if data is None:
+        # the graph only needs the authors of each issue
+        graph_columns = ['issue_id', 'authors']
+        if os.path.exists(paths['disamb']):
+            data = storage.read(paths['disamb'], args.data_format,
+                                graph_columns)
+        elif os.path.exists(paths['data']):
+            data = storage.read(paths['data'], args.data_format,
+                                graph_columns)
+        else:
+            raise ValueError('no data file for this periodical!')
+
+    if args.graph_format in ['csv', 'both']:
+        collabs = for_graph.get_collaborators(data)
+        storage.write(collabs, paths['collabs'], args.data_format)
+    if args.graph_format in ['npz', 'both']:
+        matrix = for_graph.get_collaboration_matrix(data)
+        for_graph.save_collaboration_matrix(matrix, paths['collabs_matrix'],
+                                            paths['collabs_authors'])
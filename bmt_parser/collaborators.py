@@ -2,9 +2,11 @@
 transforms the csv output that was parsed from Blue Mountain
 '''
 
+import zipfile
 import pandas as pd
 import numpy as np
-import itertools
+import bmt_parser.config as cf
+import bmt_parser.metrics as metrics
 
 
 def get_collaborators(data):
@@ -13,52 +15,148 @@ def get_collaborators(data):
     transforms it into a df that counts the number of collaborations btw two
     authors
     '''
-    # need only the sections where an author is present
-    has_author = [author is not np.nan for author in data.authors]
-    data = data.loc[has_author, ['issue_id', 'authors']]
-
-    # creating a list of collaborator pairs for each issue
-    issues = set(data.issue_id)
-    collaborators = []
-    for issue in issues:
-        target = _unique_collaborators(data.authors[data.issue_id == issue])
-        collaborators.extend(target)
-
-    # counting the nr of collaborations
-    numbered = {}
-    for collab in collaborators:
-        try:
-            numbered[collab] += 1
-        except KeyError:
-            numbered[collab] = 1
-
-    # data transform: parsing the string and turning into a pd dataframe
-    records = []
-    for key in numbered.keys():
-        collabs = key.split('||')
-        records.append([collabs[0], collabs[1], numbered[key]])
-    result = pd.DataFrame.from_records(
-        records, columns=['author1', 'author2', 'count'])
+    with metrics.stage('get_collaborators'):
+        names, first, second = _collaborator_pairs(data)
+
+        # counting the nr of collaborations, one number per pair of codes
+        n = max(len(names), 1)
+        pairs, counts = np.unique(first * n + second, return_counts=True)
+
+        result = pd.DataFrame({'author1': names[pairs // n],
+                               'author2': names[pairs % n],
+                               'count': counts},
+                              columns=['author1', 'author2', 'count'])
+
+    metrics.count('collaborator_authors', len(names))
+    metrics.count('collaborator_pairs', len(result))
+    return result
+
+
+def get_collaboration_matrix(data):
+    '''
+    takes the same DataFrame as get_collaborators and returns the number of
+    collaborations as a symmetric sparse matrix in CSR form, without going
+    through a DataFrame of name pairs.
+
+    :returns: tuple (names, indptr, indices, counts). names is the array of
+      author names, the author id being the position in names. The
+      collaborators of author i are indices[indptr[i]:indptr[i + 1]], with
+      the counts in counts[indptr[i]:indptr[i + 1]]
+    '''
+    names, first, second = _collaborator_pairs(data)
+    n = len(names)
+    width = max(n, 1)
+
+    # both directions, so that the matrix is symmetric
+    rows = np.concatenate([first, second])
+    cols = np.concatenate([second, first])
+
+    # unique keys are sorted by row and then column, which is the CSR order
+    keys, counts = np.unique(rows * width + cols, return_counts=True)
+    rows = keys // width
+    indices = (keys % width).astype(np.int32)
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+
+    return names, indptr, indices, counts.astype(np.int32)
+
+
+def save_collaboration_matrix(matrix, matrix_path, authors_path):
+    '''
+    stores the output of get_collaboration_matrix:
+      - the matrix as an uncompressed .npz file in the format of
+        scipy.sparse.save_npz, so scipy.sparse.load_npz can read it. Members
+        are not compressed, so they can be memory-mapped, see
+        load_collaboration_matrix
+      - the author dictionary (id -> name) as a csv
+    '''
+    names, indptr, indices, counts = matrix
+    np.savez(matrix_path, format=np.array(b'csr'),
+             shape=np.array([len(names), len(names)], dtype=np.int64),
+             data=counts, indices=indices, indptr=indptr)
+
+    authors = pd.DataFrame({'id': np.arange(len(names)), 'name': names},
+                           columns=['id', 'name'])
+    authors.to_csv(authors_path, sep=cf.CSV_SEP, index=False)
+
+
+def load_collaboration_matrix(matrix_path, mmap_mode=None):
+    '''
+    loads a matrix stored by save_collaboration_matrix.
+
+    :param mmap_mode: None to read the arrays into memory, or a numpy memmap
+      mode ('r', 'c'...) to map them from the file
+    :returns: dict with the arrays shape, indptr, indices and data
+    '''
+    keys = ['shape', 'indptr', 'indices', 'data']
+    if mmap_mode is None:
+        with np.load(matrix_path, allow_pickle=False) as npz:
+            return {key: npz[key] for key in keys}
 
+    result = {}
+    with zipfile.ZipFile(matrix_path) as archive, \
+            open(matrix_path, 'rb') as file:
+        for key in keys:
+            info = archive.getinfo(key + '.npy')
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('{} is compressed and cannot be mapped'
+                                 .format(key))
+            # skipping the local zip header to get to the .npy data
+            file.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(file.read(4), dtype='<u2')
+            file.seek(info.header_offset + 30 + name_len + extra_len)
+            if np.lib.format.read_magic(file) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(file)
+            else:
+                header = np.lib.format.read_array_header_2_0(file)
+            shape, fortran, dtype = header
+            result[key] = np.memmap(matrix_path, dtype=dtype, mode=mmap_mode,
+                                    offset=file.tell(), shape=shape,
+                                    order='F' if fortran else 'C')
     return result
 
 
-def _unique_collaborators(authors):
+def _author_codes(data):
+    '''returns the authors as integer codes:
+      - names: array of unique author names, sorted. The code of an author is
+        its position in names
+      - issues: array with an issue code for each author appearance
+      - codes: array with the author code for each author appearance
     '''
-    returns a list of strings like "author1||author2"
+    # need only the sections where an author is present
+    data = data.loc[data['authors'].notnull(), ['issue_id', 'authors']]
+
+    # separating multiple authors
+    authors = data['authors'].astype(str)
+    authors = authors.str.split(cf.AUTHOR_SEP, regex=False)
+    issues = np.repeat(pd.factorize(data['issue_id'])[0],
+                       authors.str.len().to_numpy())
+    authors = authors.explode().to_numpy(dtype=object)
+
+    names, codes = np.unique(authors, return_inverse=True)
+    return names, issues, codes.reshape(-1)
+
+
+def _collaborator_pairs(data):
+    '''returns (names, first, second) where first and second are arrays of
+    author codes. Each pair of authors that appears in the same issue is in
+    there once per issue, with the first author's code being the smaller one
+    (and so the first name in alphabetical order).
     '''
-    # first I need to separate multiple authors
-    separated = []
-    for string in authors:
-        target = string.split('||')
-        separated.extend(target)
-    # then create a Cartesian product of the authors and remove duplicates
-    # and authorA-authorA combinations
-    product = list(itertools.product(separated, repeat=2))
-    product = ['||'.join(sorted(collabs)) for collabs in product
-               if collabs[0] != collabs[1]]
-    product = list(set(product))
-    return product
+    names, issues, codes = _author_codes(data)
+
+    # one row per author and issue
+    authors = pd.DataFrame({'issue': issues, 'author': codes})
+    authors = authors.drop_duplicates()
+
+    # all combinations of authors within an issue, without authorA-authorA
+    # and without authorB-authorA if there is authorA-authorB
+    pairs = authors.merge(authors, on='issue', suffixes=('1', '2'))
+    pairs = pairs.loc[pairs['author1'] < pairs['author2'], :]
+
+    return (names, pairs['author1'].to_numpy(dtype=np.int64),
+            pairs['author2'].to_numpy(dtype=np.int64))
 
 
 if __name__ == '__main__':
@@ -1,11 +1,69 @@
 CSV_SEP = '\t'
 
+# format of the tables in PATHS, one of DATA_FORMATS
+DATA_FORMAT = 'csv'
+
+# choices of the command line, kept here so that they are known without
+# importing the parser modules. See storage.FORMATS, parse_alto.ENGINES and
+# parse_mets.ENGINES
+DATA_FORMATS = ['csv', 'parquet', 'feather']
+ALTO_ENGINES = ['bs4', 'lxml']
+METS_ENGINES = ['bs4', 'lxml']
+
+# column types in the columnar formats. Columns not listed here are strings
+COLUMN_TYPES = {
+    'issue_id': 'int64',
+    'date': 'string',
+    'volume': 'string',
+    'number': 'string',
+    'section_id': 'string',
+    'title': 'string',
+    'authors': 'string',
+    'section_type': 'string',
+    'type_of_resource': 'string',
+    'Head': 'string',
+    'Subhead': 'string',
+    'Byline': 'string',
+    'Copy': 'string',
+    'author1': 'string',
+    'author2': 'string',
+    'count': 'int64'
+}
+
 AUTHOR_SEP = '||'
 
 OUTPUT_DIR = './output'
 
+# number of slowest issues in the metrics report (--metrics)
+SLOWEST_ISSUES = 10
+
+# number of different records kept for every category of the diagnostics
+# report (--diagnostics), further records are only counted
+DIAGNOSTICS_RECORDS = 1000
+
+# when proposals are asked for (--match_threshold without a value or
+# --apply_name_matches), names that are not in the disambiguation file get
+# the resolved name of the closest name in the file as a proposal if their
+# similarity (from 0 to 1) is at least this, see name_matching
+NAME_MATCH_THRESHOLD = 0.75
+
+# parsed issues are cached here when running with --cache
+CACHE_DIR = './output/cache'
+
+# number of issues whose files are read in the background while parsing
+# (--read_ahead), and the maximum size of the files read ahead in bytes
+READ_AHEAD = 2
+READ_AHEAD_BYTES = 128 * 2**20
+
 PATHS = {
     'data': 'data.csv',
     'disamb': 'disamb.csv',
-    'collabs': 'collaborators.csv'
+    'collabs': 'collaborators.csv',
+    # sparse co-authorship matrix and its author dictionary
+    'collabs_matrix': 'collaborators.npz',
+    'collabs_authors': 'collaborators_authors.csv'
 }
+
+# output formats of the graph transformation: "csv" is a table of author
+# pairs, "npz" a sparse matrix, see collaborators.save_collaboration_matrix
+GRAPH_FORMATS = ['csv', 'npz', 'both']
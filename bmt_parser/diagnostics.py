@@ -0,0 +1,159 @@
+'''
+Collects the problems found in the data (ignored sections, names without a
+disambiguation...) instead of logging a line for each of them. On large runs
+there are tens of thousands of these.
+
+Problems are recorded with a category, a message and the values for the
+message. The message is only formatted when the report is made, and equal
+records of a category are counted once. Up to max_records different records
+are kept for every category; after that, and for all records in quiet mode,
+they are only counted.
+
+Like metrics, the records are kept at module level. Worker processes send
+their records to the parent with collect() and merge(). At the end of every
+stage, the summarized() block logs one line per category for the records of
+the stage, and write() stores the full report as json.
+'''
+
+import contextlib
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+_quiet = False
+_max_records = 1000
+# {category: {'message': str, 'count': int, 'records': {values: count}}}
+_categories = {}
+
+
+def configure(quiet=False, max_records=1000):
+    '''
+    @param quiet: only count the records, without keeping their values
+    @param max_records: number of different records kept per category
+    '''
+    global _quiet, _max_records
+    _quiet = quiet
+    _max_records = max_records
+
+
+def reset():
+    global _categories
+    _categories = {}
+
+
+def record(category, message, *values):
+    '''records a problem. message is formatted with values (str.format) when
+    the report is made. The values need to be hashable
+    '''
+    entry = _entry(category, message)
+    entry['count'] += 1
+    if not _quiet:
+        _add(entry, values, 1)
+
+
+def record_many(category, message, values):
+    '''records a problem for every item of values. The items are tuples of
+    values for the message, or single values
+    '''
+    if not len(values):
+        return
+    entry = _entry(category, message)
+    if _quiet:
+        entry['count'] += len(values)
+        return
+    for value in values:
+        entry['count'] += 1
+        _add(entry, value if isinstance(value, tuple) else (value,), 1)
+
+
+def count(category):
+    '''returns the number of records of a category'''
+    return _categories[category]['count'] if category in _categories else 0
+
+
+def collect():
+    '''returns the records since the last call and resets them. Used to send
+    the records of a worker process to the parent
+    '''
+    data = _categories
+    reset()
+    return data
+
+
+def merge(data):
+    '''adds records returned by collect() in another process'''
+    for category, other in data.items():
+        entry = _entry(category, other['message'])
+        entry['count'] += other['count']
+        for values, n in other['records'].items():
+            _add(entry, values, n)
+
+
+def report():
+    '''returns the records as a dict {category: {'count': number of records,
+    'distinct': number of different records kept, 'records': [[message,
+    count]...]}}, the most frequent records first
+    '''
+    result = {}
+    for category in sorted(_categories):
+        entry = _categories[category]
+        records = sorted(((entry['message'].format(*values), n)
+                          for values, n in entry['records'].items()),
+                         key=lambda r: (-r[1], r[0]))
+        result[category] = {'count': entry['count'],
+                            'distinct': len(records),
+                            'records': [list(r) for r in records]}
+    return result
+
+
+def log_summary(since=None):
+    '''logs one warning for every category, with an example. If since
+    ({category: count}) is given, only the records made after it are counted
+    and the categories without new records are left out
+    '''
+    since = since or {}
+    for category, entry in report().items():
+        n = entry['count'] - since.get(category, 0)
+        if not n:
+            continue
+        example = ''
+        if entry['records']:
+            example = ', e.g. ' + entry['records'][0][0]
+        logger.warning('%s: %d records%s', category, n, example)
+
+
+@contextlib.contextmanager
+def summarized():
+    '''logs the summary of the records made in the with block at its end,
+    see log_summary. The stages run in it, so that their problems are logged
+    whichever entry point runs them
+    '''
+    since = {category: entry['count']
+             for category, entry in _categories.items()}
+    try:
+        yield
+    finally:
+        log_summary(since)
+
+
+def write(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2, ensure_ascii=False)
+
+
+def _entry(category, message):
+    if category not in _categories:
+        _categories[category] = {'message': message, 'count': 0,
+                                 'records': {}}
+    return _categories[category]
+
+
+def _add(entry, values, n):
+    records = entry['records']
+    if values in records:
+        records[values] += n
+    elif len(records) < _max_records:
+        records[values] = n
@@ -21,27 +21,35 @@ import json
 import logging
 import pandas as pd
 import numpy as np
-import re
 import bmt_parser.config as cf
 import bmt_parser.name_corrections as corr
+import bmt_parser.name_matching as matching
+import bmt_parser.storage as storage
+import bmt_parser.metrics as metrics
+import bmt_parser.diagnostics as diagnostics
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.WARNING)
-logger.addHandler(stream_handler)
+# memoizes the name normalization, the same names appear in many rows. It is
+# cleared at the start of every disambiguation, so that a run does not
+# depend on the runs before it
+normalizer = corr.NameNormalizer()
 
-file_handler = logging.FileHandler('parse.log')
-file_handler.setLevel(logging.INFO)
-logger.addHandler(file_handler)
 
-
-def prepare_disambiguation_file(path, names_in_data, name_replacements=None):
+def prepare_disambiguation_file(path, names_in_data, name_replacements=None,
+                                match_threshold=None, apply_matches=False,
+                                apply_initials=False):
     '''
     path: path to disamb file
     names_in_data: Set of unique names present in the dataset
     name_replacements: dict where key=resolved name, and value=replacement
+    match_threshold: minimum score of the proposals for names that are not in
+      the disambiguation file, see match_missing_names. None (the default)
+      for no proposals
+    apply_matches: use the proposals as the resolved names. The proposals
+      are made with config.NAME_MATCH_THRESHOLD if match_threshold is None
+    apply_initials: replace initials with the full name if there is only one
+      candidate, see resolve_initials
     '''
     table = pd.read_csv(path, sep=cf.CSV_SEP)
     table = table.loc[:, ['Unique Names', 'NameCopy']]
@@ -62,197 +70,396 @@ def prepare_disambiguation_file(path, names_in_data, name_replacements=None):
     if name_replacements:
         counter = 0
         for key, value in name_replacements.items():
-            table['resolved'][table['resolved'] == key] = value
+            table.loc[table['resolved'] == key, 'resolved'] = value
             counter += 1
-        logger.warning('{} names were replaced with values in '
-                       'the provided name_replacement json'.format(counter))
+        logger.warning('%d names were replaced with values in '
+                       'the provided name_replacement json', counter)
 
     table = fix_names(table)
     table = fix_repeated_resolved(table)
-    table = resolve_initials(table)
+    table = resolve_initials(table, apply_initials)
+
+    if apply_matches and match_threshold is None:
+        match_threshold = cf.NAME_MATCH_THRESHOLD
+    if match_threshold is not None:
+        table = match_missing_names(table, match_threshold)
+        if apply_matches:
+            proposed = table['resolved_proposal'].notnull()
+            table.loc[proposed, 'resolved'] = \
+                table.loc[proposed, 'resolved_proposal']
 
     return table
 
 
 def add_missing_names(table, names_in_data):
-    '''adds names that are in the dataset but not in the disambiguation file
+    '''adds names that are in the dataset but not in the disambiguation file,
+    resolved to themselves. The column in_disambiguation is False for them
     '''
     names_in_disamb = set(table.found)
     # names in disamb but not in data.
     # these might indicate an error in parsing
     not_found = names_in_disamb.difference(names_in_data)
-    percent_format = "{:.1%}".format(len(not_found) / len(names_in_disamb))
-    logger.warning('{} names in disambiguation ({}) not present in the dataset'
-                   .format(len(not_found), percent_format))
-    logger.info('\n'.join(sorted(not_found)))
+    logger.warning('%d names in disambiguation (%.1f%%) not present in the '
+                   'dataset', len(not_found),
+                   100 * len(not_found) / len(names_in_disamb))
+    diagnostics.record_many('name_not_in_data',
+                            'name in disambiguation not in the dataset: "{}"',
+                            not_found)
 
     # reverse: names that are present in the dataset but not in the disamb file
     not_found = names_in_data.difference(names_in_disamb)
-    percent_format = "{:.1%}".format(len(not_found) / len(names_in_data))
-    logger.warning('{} names ({}) not found in the disambiguation file'
-                   .format(len(not_found), percent_format))
-    logger.info('\n'.join(sorted(not_found)))
+    logger.warning('%d names (%.1f%%) not found in the disambiguation file',
+                   len(not_found), 100 * len(not_found) / len(names_in_data))
+    diagnostics.record_many('name_not_in_disambiguation',
+                            'name not in the disambiguation file: "{}"',
+                            not_found)
 
     # adding missing names to table
     missing_names = pd.DataFrame([[name, name] for name in not_found],
                                  columns=['found', 'resolved'])
-    table = table.append(missing_names, ignore_index=True)
+    table = pd.concat([table.assign(in_disambiguation=True),
+                       missing_names.assign(in_disambiguation=False)],
+                      ignore_index=True)
+
+    return table
+
+
+def match_missing_names(table, threshold=cf.NAME_MATCH_THRESHOLD):
+    '''proposes a resolved name for the names that are not in the
+    disambiguation file (see add_missing_names): the resolved name of the
+    closest found name in the file, if their similarity is at least
+    threshold. Names are compared by their n-grams, see name_matching.
+
+    Adds the columns resolved_proposal and proposal_score (from 0 to 1),
+    which are missing values for names without a proposal.
+    '''
+    known = table.loc[table['in_disambiguation'], ['found', 'resolved']]
+    known = known.drop_duplicates('found')
+    missing = table.index[~table['in_disambiguation'].astype(bool)]
+
+    index = matching.NgramIndex(known['found'])
+    positions, scores = index.match(table.loc[missing, 'found'], threshold)
+    matched = positions >= 0
+
+    table['resolved_proposal'] = pd.Series(index=table.index, dtype=object)
+    table['proposal_score'] = np.nan
+    table.loc[missing[matched], 'resolved_proposal'] = \
+        known['resolved'].values[positions[matched]]
+    table.loc[missing[matched], 'proposal_score'] = scores[matched]
+
+    logger.warning('%d of %d names not found in the disambiguation file have '
+                   'a proposal', matched.sum(), len(missing))
+    metrics.count('name_proposals', int(matched.sum()))
+    proposals = table.loc[missing[matched]]
+    diagnostics.record_many(
+        'name_proposal', 'proposed "{}" for "{}" (score {:.2f})',
+        list(zip(proposals['resolved_proposal'], proposals['found'],
+                 proposals['proposal_score'])))
 
     return table
 
 
 def fix_names(table):
-    # stripping whitespace
-    table['resolved'] = pd.Series([s.strip() for s in table['resolved']])
-    table['found'] = pd.Series([s.strip() for s in table['found']])
+    '''normalizes the found and resolved names and adds the columns
+    resolved_original, titles, initials_found, initials_resolved,
+    found_are_initials and surname_found.
 
-    # removing strange characters (string terminators, etc)
-    table['resolved'] = table['resolved'].apply(corr.remove_strange_chars)
-    table['found'] = table['found'].apply(corr.remove_strange_chars)
+    Every distinct name is normalized once and the results are mapped back
+    to the rows, so names repeated in the table are not processed again.
+    '''
+    # stripping whitespace and removing strange characters (string
+    # terminators, etc)
+    resolved = _clean_names(table['resolved'])
+    found = _clean_names(table['found'])
+
+    resolved_names = _resolved_columns(resolved.unique())
+    found_names = _found_columns(found.unique())
+
+    table['resolved'] = resolved_names['resolved'].reindex(resolved).values
+    table['found'] = found_names['found'].reindex(found).values
+    table['resolved_original'] = resolved.values
+    table['titles'] = found_names['titles'].reindex(found).values
+    table['initials_found'] = (found_names['initials_found']
+                               .reindex(found).values)
+    table['initials_resolved'] = (resolved_names['initials_resolved']
+                                  .reindex(resolved).values)
+    table['found_are_initials'] = (found_names['found_are_initials']
+                                   .reindex(found).values)
+    table['surname_found'] = (found_names['surname_found']
+                              .reindex(found).values)
+
+    return table
 
-    # removing years from resolved names
-    table['resolved_original'] = table['resolved']
-    table['resolved'] = table['resolved'].apply(corr.strip_year)
 
-    # transforming into "Name Surname" for resolved names
-    table['resolved'] = table['resolved'].apply(corr.order_names)
+def _clean_names(names):
+    names = names.astype(str).str.strip()
+    return names.str.replace(corr.STRANGE_CHARS, '', regex=True)
 
-    # getting title (Dr., Prof.) and storing into the table
-    titles = [corr.get_title_and_rest(name) for name in table['found']]
-    names = [t[1] for t in titles]
-    titles = [t[0] for t in titles]
-    table['titles'] = pd.Series(titles)
 
+def _resolved_columns(names):
+    '''returns a DataFrame indexed by the distinct resolved names, with the
+    normalized name and its initials
+    '''
+    # removing years and transforming into "Name Surname"
+    result = pd.Series(names, index=names, dtype=object)
+    result = result.str.replace(corr.YEAR, '', regex=True)
+    result = result.map(normalizer.order_names)
     # turning all caps into proper form
-    table['resolved'] = table['resolved'].apply(corr.capitalize)
-    table['found'] = table['found'].apply(corr.capitalize)
+    result = result.map(normalizer.capitalize)
+    return pd.DataFrame({'resolved': result,
+                         'initials_resolved': result.map(
+                             normalizer.get_initials)})
 
-    # getting initials from name
-    initials = [corr.fix_initials(name) if corr.are_initials(name)
-                else corr.get_initials(name) for name in names]
-    table['initials_found'] = pd.Series(initials)
-    table['initials_resolved'] = table['resolved'].apply(corr.get_initials)
 
-    table['found_are_initials'] = pd.Series([corr.are_initials(name)
-                                            for name in names])
+def _found_columns(names):
+    '''returns a DataFrame indexed by the distinct found names, with the
+    capitalized name, title (Dr., Prof.), initials and surname
+    '''
+    titles = [normalizer.get_title_and_rest(name) for name in names]
+    rest = pd.Series([t[1] for t in titles], index=names, dtype=object)
+    are_initials = rest.map(normalizer.are_initials).astype(bool)
+
+    initials = rest.map(normalizer.get_initials)
+    initials[are_initials] = rest[are_initials].map(normalizer.fix_initials)
+
+    capitalized = pd.Series(names, index=names, dtype=object).map(
+        normalizer.capitalize)
+    return pd.DataFrame({
+        'found': capitalized,
+        'titles': [t[0] for t in titles],
+        'initials_found': initials,
+        'found_are_initials': are_initials,
+        'surname_found': capitalized.str.rsplit(' ', n=1).str[-1]},
+        index=names)
+
+
+def resolve_initials(table, apply=False):
+    '''finds the full name of the found names that are initials ("H. W.",
+    "Dr. A. D.") and that the disambiguation file does not resolve.
+
+    The candidates are the resolved names of the rows that are not initials,
+    indexed by their title (Dr., Prof.) and the initials of the name. Initials
+    with a title are looked up with the title, and without it if no name has
+    the title. If there is only one candidate, it is the replacement; else
+    the initials are ambiguous. Both are recorded in the diagnostics, and
+    replacements are written to the resolved column if apply is True.
+    '''
+    full = table.loc[~table['found_are_initials'].astype(bool)]
+    rest = full['resolved'].map(
+        lambda name: normalizer.get_title_and_rest(name)[1])
+    candidates = pd.DataFrame({
+        'title': _title_key(full['titles']),
+        'initials': _initials_key(rest.map(normalizer.get_initials)),
+        'resolved': full['resolved']})
+    by_title = candidates.groupby(['title', 'initials'])['resolved'].agg(
+        ['nunique', 'first'])
+    by_initials = candidates.groupby('initials')['resolved'].agg(
+        ['nunique', 'first'])
 
-    # getting the surname
-    splits = [name.split(' ') for name in table['found']]
-    table['surname_found'] = pd.Series([s[len(s) - 1] for s in splits])
+    # initials that do not have a full name
+    unresolved = table.loc[table['found_are_initials'].astype(bool) &
+                           (table['resolved'] == table['found'])]
+    titles = _title_key(unresolved['titles'])
+    initials = _initials_key(unresolved['initials_found'])
+    with_title = by_title.reindex(pd.MultiIndex.from_arrays(
+        [titles, initials])).set_axis(unresolved.index)
+    without_title = by_initials.reindex(initials).set_axis(unresolved.index)
+    use_title = (titles != '') & with_title['nunique'].notnull()
+    found = without_title.mask(use_title, with_title)
+    count = found['nunique'].fillna(0)
+
+    replaced = unresolved.index[count == 1]
+    ambiguous = unresolved.index[count > 1]
+    missing = unresolved.index[count == 0]
+    diagnostics.record_many('initials_replacement',
+                            'replacement found for "{}": "{}"',
+                            list(zip(table.loc[replaced, 'found'],
+                                     found.loc[replaced, 'first'])))
+    diagnostics.record_many('initials_ambiguous',
+                            'initials "{}" match {} names, e.g. "{}"',
+                            list(zip(table.loc[ambiguous, 'found'],
+                                     count[ambiguous].astype(int),
+                                     found.loc[ambiguous, 'first'])))
+    diagnostics.record_many('initials_without_replacement',
+                            'no replacement found for initials "{}"',
+                            list(table.loc[missing, 'found']))
+
+    if apply:
+        table.loc[replaced, 'resolved'] = found.loc[replaced, 'first']
+        metrics.count('initials_resolved', len(replaced))
+        logger.warning('%d of %d unresolved initials were replaced with a '
+                       'full name, %d are ambiguous', len(replaced),
+                       len(unresolved), len(ambiguous))
 
     return table
 
 
-def resolve_initials(table):
-    # getting resolved names initials
-    tgt = table.loc[~table['found_are_initials'],
-                    ['initials_resolved', 'resolved']].itertuples()
-    tgt = [(t[1], t[2]) for t in tgt]
-    tgt = list(set(tgt))
-
-    counts = {}
-    for i in tgt:
-        initials = i[0].upper()  # disregarding lowercase letters
-        try:
-            counts[initials]['count'] += 1
-        except KeyError:
-            counts[initials] = {}
-            counts[initials]['name'] = i[1]
-            counts[initials]['count'] = 1
-    replacements = {c[0]: c[1]['name'] for c in counts.items()
-                    if c[1]['count'] == 1}
+def _title_key(titles):
+    '''returns the titles in lowercase without dots and spaces'''
+    return titles.fillna('').astype(str).str.lower().str.replace(
+        '[\\W\\d_]+', '', regex=True)
 
-    # initials that do not have a full name
-    indices = table.loc[table['found_are_initials'], :].index
-    for idx in indices:
-        row = table.iloc[idx, ]
-        try:
-            initials = row['initials_found']
-            logger.warning('replacements found for "{}": "{}"'.format(
-                           initials, replacements[initials]))
-        except KeyError:
-            logger.warning('no replacement found for initials "{}"'
-                           .format(initials))
 
-    return table
+def _initials_key(initials):
+    '''returns the letters of the initials in uppercase'''
+    return initials.fillna('').astype(str).str.upper().str.replace(
+        '[\\W\\d_]+', '', regex=True)
 
 
 def fix_repeated_resolved(table):
-    # searching for cases when resolved name is repeated as found name
-    copy = table.loc[table['resolved'] != table['found'], :]
-    names = list(copy['found'])
-    cases = [_ for _ in copy['resolved'] if _ in names]
-
-    # replacing those names
-    replacements = {'resolved': {}}
-    for resolved in cases:
-        idx_found = table['found'] == resolved
-        # should have only one True
-        if sum(idx_found) != 1:
-            raise ValueError('duplicated found names!')
-        idx_found = np.nonzero(idx_found)[0][0]
-        new_name = table.get_value(index=idx_found, col='resolved')
-        replacements['resolved'][resolved] = new_name
-
-    if replacements['resolved']:
-        table = table.replace(to_replace=replacements)
+    '''replaces resolved names that are also found names with the name they
+    resolve to, following chains (A -> B -> C) to their end, the name that
+    does not resolve to another name.
+
+    The resolutions are a union-find forest in which every found name points
+    to its resolved name. Finding the end of a chain compresses the path, so
+    the whole table is resolved in near-linear time. A resolution that would
+    close a cycle (A -> B -> A) is not followed and is recorded in the
+    diagnostics. The names of the cycle then resolve to the name where it
+    was closed. Of found names with several resolved names, the first one
+    is followed.
+    '''
+    parent = {}
+    # the first resolution of every found name, also if it is not followed
+    resolutions = {}
+    for found, resolved in zip(table['found'], table['resolved']):
+        if found == resolved:
+            continue
+        if found in resolutions:
+            if resolutions[found] != resolved:
+                diagnostics.record('repeated_found_name',
+                                   'found name "{}" resolves to "{}" and '
+                                   '"{}", using the first', found,
+                                   resolutions[found], resolved)
+            continue
+        resolutions[found] = resolved
+        if _find(parent, resolved) == found:
+            diagnostics.record('resolution_cycle',
+                               'resolutions form a cycle: {}',
+                               ' -> '.join(_cycle(resolutions, found,
+                                                  resolved)))
+            continue
+        parent[found] = resolved
+
+    ends = {name: _find(parent, name) for name in table['resolved'].unique()}
+    ends = table['resolved'].map(ends)
+    changed = int((ends != table['resolved']).sum())
+    if changed:
+        logger.warning('%d resolved names were replaced with the end of '
+                       'their resolution chain', changed)
+    metrics.count('chained_resolutions', changed)
+    table['resolved'] = ends
 
     return table
 
 
+def _find(parent, name):
+    '''returns the end of the chain of name in the union-find forest parent,
+    pointing the names on the way directly to it
+    '''
+    end = name
+    while end in parent:
+        end = parent[end]
+    while name != end:
+        parent[name], name = end, parent[name]
+    return end
+
+
+def _cycle(resolutions, found, resolved):
+    '''returns the names of the cycle that the resolution found -> resolved
+    would close, from the resolutions of the found names
+    '''
+    names = [found, resolved]
+    while names[-1] != found:
+        names.append(resolutions[names[-1]])
+    return names
+
+
 def disambiguate_names(original_data, disamb_data):
-    disamb_data = {row[1]: row[2] for row
-                   in disamb_data.loc[:, ['found', 'resolved']].itertuples()}
-    for i, row in original_data.iterrows():
-        if row.authors is not np.nan:
-            multiple = re.search(cf.AUTHOR_SEP, row.authors)
-            try:
-                if multiple:
-                    authors = [corr.capitalize(a.strip()) for a
-                               in row.authors.split(cf.AUTHOR_SEP)]
-                    authors = [disamb_data[author] for author in authors]
-                    original_data.set_value(
-                        i, 'authors', cf.AUTHOR_SEP.join(authors))
-                else:
-                    author = corr.capitalize(row.authors.strip())
-                    original_data.set_value(i, 'authors',
-                                            disamb_data[row.authors])
-            except KeyError:
-                logger.warning('author(s) "{}" do not have disambiguations'
-                               .format(row.authors))
+    '''replaces the names in the authors column with the resolved names.
+
+    Works on all authors at once: every name is capitalized once and looked
+    up in the disambiguation table. Rows that have a name without a
+    disambiguation are left unchanged and each such name is recorded once in
+    the diagnostics.
+    '''
+    disamb_data = dict(zip(disamb_data['found'], disamb_data['resolved']))
+
+    # one row per author, the index points to the row in original_data
+    names = _split_authors(original_data['authors']).str.strip()
+    capitalized = {name: normalizer.capitalize(name)
+                   for name in names.unique()}
+    resolved = names.map(capitalized).map(disamb_data)
+
+    missing = resolved.isnull()
+    diagnostics.record_many('author_without_disambiguation',
+                            'author "{}" does not have a disambiguation',
+                            set(names[missing]))
+
+    # only rows where all authors have a disambiguation are changed
+    incomplete = set(resolved.index[missing])
+    resolved = resolved[~resolved.index.isin(incomplete)]
+    joined = resolved.groupby(level=0, sort=False).agg(cf.AUTHOR_SEP.join)
+    original_data.loc[joined.index, 'authors'] = joined
 
     return original_data
 
 
+def _split_authors(authors):
+    '''splits multiple authors and returns a Series with one name per row.
+    The index of the Series is the index of the row in authors
+    '''
+    authors = authors[authors.notnull()].astype(str)
+    return authors.str.split(cf.AUTHOR_SEP, regex=False).explode()
+
+
 def main(disamb_path, original_path, name_replacements_path,
-         disamb_write_path=None):
-    original_data = pd.read_csv(original_path, delimiter=cf.CSV_SEP)
-
-    if name_replacements_path:
-        name_replacements = json.load(open(name_replacements_path, 'r'))
-
-    # gathering all unique names in the data into a set
-    unique_names = []
-    for author in original_data['authors']:
-        if author is not np.nan:
-            if re.search(cf.AUTHOR_SEP, author):
-                author_split = author.split('||')
-                unique_names.extend(author_split)
-            else:
-                unique_names.append(author)
-    unique_names = set(unique_names)
-
-    disamb_data = prepare_disambiguation_file(disamb_path, unique_names,
-                                              name_replacements)
-    if disamb_write_path:
-        disamb_data.to_csv(disamb_write_path, index=False)
-
-    new_file = disambiguate_names(original_data, disamb_data)
+         disamb_write_path=None, data_format='csv', match_threshold=None,
+         apply_matches=False, apply_initials=False):
+    '''
+    @param data_format: format of the file in original_path, see
+      storage.FORMATS
+    @param match_threshold, apply_matches, apply_initials: see
+      prepare_disambiguation_file
+    '''
+    original_data = storage.read(original_path, data_format)
+    return disambiguate_data(original_data, disamb_path,
+                             name_replacements_path, disamb_write_path,
+                             match_threshold, apply_matches, apply_initials)
+
+
+def disambiguate_data(original_data, disamb_path, name_replacements_path=None,
+                      disamb_write_path=None, match_threshold=None,
+                      apply_matches=False, apply_initials=False):
+    '''like main, but takes the parsed data as a DataFrame'''
+    normalizer.clear()
+    with metrics.stage('disambiguate_names'), diagnostics.summarized():
+        name_replacements = None
+        if name_replacements_path:
+            name_replacements = json.load(open(name_replacements_path, 'r'))
+
+        # gathering all unique names in the data into a set
+        unique_names = set(_split_authors(original_data['authors']))
+        metrics.count('authors', len(unique_names))
+
+        disamb_data = prepare_disambiguation_file(disamb_path, unique_names,
+                                                  name_replacements,
+                                                  match_threshold,
+                                                  apply_matches,
+                                                  apply_initials)
+        if disamb_write_path:
+            disamb_data.to_csv(disamb_write_path, index=False)
+
+        new_file = disambiguate_names(original_data, disamb_data)
+
+    metrics.count('name_cache_hits', normalizer.hits)
+    metrics.count('name_cache_misses', normalizer.misses)
     return new_file
 
 
 if __name__ == '__main__':
     import argparse
+    import bmt_parser.cli as cli
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--disambiguation_path', '-d', required=True,
@@ -268,7 +475,7 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    open('parse.log', 'w').close()  # emptying log
+    cli.configure_logging()
 
-    res = main(args.disambiguation_path, args.data_file, name_replacements,
-               args.store_disamb)
+    res = main(args.disambiguation_path, args.data_file,
+               args.name_replacements, args.store_disamb)
@@ -0,0 +1,103 @@
+'''
+Collects metrics of a run, to find slow issues and to size machines:
+
+ - wall time per stage (summed over all calls of the stage)
+ - counts: bytes read, issues, sections, TextBlocks, authors...
+ - the time spent on every issue, to report the slowest ones
+ - peak memory of this process and of finished worker processes
+
+Like the loggers, the metrics are kept at module level. Worker processes
+collect their own metrics, which are sent back to the parent with collect()
+and added with merge(). write() stores a json report at the end of a run.
+'''
+
+import contextlib
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+_started = time.time()
+_stages = {}
+_counts = {}
+_issues = []
+
+
+def reset():
+    global _started, _stages, _counts, _issues
+    _started = time.time()
+    _stages = {}
+    _counts = {}
+    _issues = []
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''adds the wall time of the with block to the stage'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages[name] = _stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def count(name, n=1):
+    _counts[name] = _counts.get(name, 0) + n
+
+
+def record_issue(mets_path, seconds):
+    _issues.append((seconds, mets_path))
+
+
+def collect():
+    '''returns the metrics collected since the last call and resets them. Used
+    to send the metrics of a worker process to the parent
+    '''
+    data = {'stages': _stages, 'counts': _counts, 'issues': _issues}
+    reset()
+    return data
+
+
+def merge(data):
+    '''adds metrics returned by collect() in another process'''
+    for name, seconds in data['stages'].items():
+        _stages[name] = _stages.get(name, 0.0) + seconds
+    for name, n in data['counts'].items():
+        count(name, n)
+    _issues.extend(data['issues'])
+
+
+def peak_memory():
+    '''returns the peak resident memory in bytes of this process and of the
+    finished child processes (the largest one), or None if unknown
+    '''
+    if resource is None:
+        return {'self': None, 'children': None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        'children': (resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+                     * unit)}
+
+
+def report(slowest=10):
+    '''returns the metrics as a dict, with the slowest issues'''
+    issues = sorted(_issues, reverse=True)[:slowest]
+    return {
+        'wall_time': time.time() - _started,
+        'stages': dict(_stages),
+        'counts': dict(_counts),
+        'peak_memory': peak_memory(),
+        'slowest_issues': [{'mets_path': path, 'seconds': seconds}
+                           for seconds, path in issues]}
+
+
+def write(path, slowest=10):
+    with open(path, 'w') as f:
+        json.dump(report(slowest), f, indent=2)
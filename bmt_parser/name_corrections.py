@@ -1,26 +1,36 @@
+'''
+Functions for normalizing names: capitalization, initials, titles, years.
+
+The same names are normalized many times, so modules that normalize whole
+tables should use a NameNormalizer, which memoizes the results.
+'''
+
+import functools
 import re
 
 
+STRANGE_CHARS = re.compile('[\x98\x9c]')
+# capitalize() splits names on these
+CAPITALIZE_SEP = re.compile('([\\( -])')
+INITIALS = re.compile('^((Dr\\.?) ?)?([A-z])(\\.| )+([A-z]\\.? +)*'
+                      '([A-z]\\.? *)$')
+INITIAL_PARTS = re.compile('Dr\\.? ?|[A-z]\\.? *')
+NAME_PARTS = re.compile("[\\w']+\\.? *")
+YEAR = re.compile('[, ]+[0-9\\?\\.\\(\\)]*-[0-9\\?\\.\\(\\)]*.*$')
+
+
 def remove_strange_chars(string):
-    return re.sub('[\x98\x9c]', '', string)
+    return STRANGE_CHARS.sub('', string)
 
 
 def capitalize(string):
     if are_initials(string):
         return string
     elif any([s.isupper() for s in string.split(' ')]):
-
-        result = ''
-        rest = string
-        regex = '[\\( -]'
-        m = re.search(regex, rest)
-        while m:
-            result = result + rest[:m.end()].capitalize()
-            rest = rest[m.end():]
-            m = re.search(regex, rest)
-        result = result + rest.capitalize()
-
-        return result
+        # capitalizing every part after "(", " " or "-". The separators are
+        # kept by the split and are not changed by capitalize
+        return ''.join([part.capitalize()
+                        for part in CAPITALIZE_SEP.split(string)])
     else:
         return string
 
@@ -34,29 +44,28 @@ def split_and_capitalize(string, sep):
 
 
 def are_initials(string):
-    match = re.search('^((Dr\.?) ?)?([A-z])(\.| )+([A-z]\.? +)*'
-                      '([A-z]\.? *)$', string)
+    match = INITIALS.search(string)
     return True if match else False
 
 
 def fix_initials(string):
-    matches = re.findall('Dr\.? ?|[A-z]\.? *', string)
-    result = ' '.join([m.strip() if re.search('\.', m) else (m.strip() + '.')
+    matches = INITIAL_PARTS.findall(string)
+    result = ' '.join([m.strip() if '.' in m else (m.strip() + '.')
                        for m in matches])
     return result
 
 
 def get_initials(string):
-    matches = re.findall("[\w']+\.? *", string)
+    matches = NAME_PARTS.findall(string)
     matches = [(m.strip()[0] + '.') for m in matches]
     initial = ' '.join(matches)
     return initial
 
 
-addon = '( [a-z][a-z]+\.)?'
+addon = '( [a-z][a-z]+\\.)?'
 TITLES = [
-    '[Pp]rof\.?',
-    '[Dd]r\.?'
+    '[Pp]rof\\.?',
+    '[Dd]r\\.?'
 ]
 LONGFORMS = {
     '[Dd]o[kc]tor': 'Dr.',
@@ -66,21 +75,24 @@ LONGFORMS = {
 TITLES.extend(LONGFORMS.keys())
 TITLES = [''.join([t, addon]) for t in TITLES]
 
+TITLES_RE = re.compile('|'.join(TITLES))
+LONGFORMS_RE = [(re.compile(l_re), short) for l_re, short in LONGFORMS.items()]
+
 
 def get_title_and_rest(string):
-    match = re.match('|'.join(TITLES), string)
+    match = TITLES_RE.match(string)
     if match:
         title = string[match.start():match.end()]
         # shortening longform
-        for l_re in LONGFORMS.keys():
-            match_longform = re.match(l_re, title)
+        for l_re, short in LONGFORMS_RE:
+            match_longform = l_re.match(title)
             if match_longform:
                 longform = title[match_longform.start():match_longform.end()]
-                title = title.replace(longform, LONGFORMS[l_re])
+                title = title.replace(longform, short)
                 break
 
         # adding dots
-        title = ' '.join([(substr + '.') if not re.search('\.', substr)
+        title = ' '.join([(substr + '.') if '.' not in substr
                          else substr for substr in title.split(' ')])
         title = title.capitalize()
         return (title, string[match.end():].strip())
@@ -91,18 +103,59 @@ def get_title_and_rest(string):
 
 
 def strip_year(string):
-    return re.sub('[, ]+[0-9\?\.\(\)]*-[0-9\?\.\(\)]*.*$', '', string)
+    return YEAR.sub('', string)
 
 
 def order_names(string):
     '''orders a "surname, name" to "name surname" (removes the comma), or
     returns the string if there is no comma
     '''
-    match = re.search(',', string)
-    if match:
-        split = re.split(',', string)
+    if ',' in string:
+        split = string.split(',')
         split.reverse()
         return ' '.join([s.strip() for s in split])
     else:
         return string
-    return string
+
+
+class NameNormalizer(object):
+    '''has the normalization functions of this module as methods, with the
+    results memoized in a bounded (least recently used) cache per function.
+
+        normalizer = NameNormalizer()
+        normalizer.capitalize('VERA IDELSON')
+        normalizer.stats()  # hits and misses of the caches
+    '''
+
+    FUNCTIONS = ['remove_strange_chars', 'capitalize', 'are_initials',
+                 'fix_initials', 'get_initials', 'get_title_and_rest',
+                 'strip_year', 'order_names']
+
+    def __init__(self, maxsize=100000):
+        '''
+        @param maxsize: maximum number of names cached for each function
+        '''
+        for name in self.FUNCTIONS:
+            setattr(self, name, functools.lru_cache(maxsize)(globals()[name]))
+
+    @property
+    def hits(self):
+        return sum(getattr(self, name).cache_info().hits
+                   for name in self.FUNCTIONS)
+
+    @property
+    def misses(self):
+        return sum(getattr(self, name).cache_info().misses
+                   for name in self.FUNCTIONS)
+
+    def stats(self):
+        '''returns a dict {function name: (hits, misses)}'''
+        result = {}
+        for name in self.FUNCTIONS:
+            info = getattr(self, name).cache_info()
+            result[name] = (info.hits, info.misses)
+        return result
+
+    def clear(self):
+        for name in self.FUNCTIONS:
+            getattr(self, name).cache_clear()
@@ -0,0 +1,226 @@
+'''
+Approximate matching of names, to find the known name closest to a name that
+is not in the disambiguation file. Those are often OCR variants of known
+names ("Herwarth Walclen").
+
+Names are compared by their character n-grams with the Dice coefficient:
+2 * shared n-grams / (n-grams of one name + n-grams of the other), from 0 to
+1. An NgramIndex keeps the names that have each n-gram (an inverted index),
+so a name is only compared with some of the names it shares an n-gram with,
+not with every name:
+
+ - a name that scores at least the threshold shares one of the rarest
+   n-grams of the query (its prefix, longer for a lower threshold). Only the
+   names of those n-grams are candidates
+ - candidates with too few or too many n-grams for the threshold, or that
+   share too few of the rare n-grams, are dropped before their n-grams are
+   compared
+ - n-grams of more than max_postings names (" ma", "er ") are not used to
+   find candidates. A query whose rare n-grams are all that frequent may
+   miss its match
+ - the shared n-grams of the candidates are counted with numpy, for batches
+   of queries with up to max_pairs candidates together
+'''
+
+import math
+import re
+import numpy as np
+
+
+NGRAM_SIZE = 3
+NON_LETTERS = re.compile('[\\W\\d_]+')
+# n-grams of more names than this are not used to find candidates
+MAX_POSTINGS = 2000
+# maximum number of (query, candidate) pairs compared at once
+MAX_PAIRS = 500000
+# maximum size of the tables of a batch, (queries x names) and
+# (queries x n-grams)
+MAX_TABLE = 2**22
+
+
+def name_key(name):
+    '''returns the lowercase letters of a name, with single spaces between
+    the words and around the name, so that n-grams mark word boundaries
+    '''
+    return ' {} '.format(NON_LETTERS.sub(' ', name.lower()).strip())
+
+
+def ngrams(name, n=NGRAM_SIZE):
+    '''returns the set of n-grams of a name'''
+    key = name_key(name)
+    return {key[i:i + n] for i in range(max(len(key) - n + 1, 1))}
+
+
+def size_bounds(size, threshold):
+    '''returns the smallest and largest number of n-grams of a name whose
+    Dice score with a name of size n-grams can be at least threshold
+    '''
+    if threshold <= 0:
+        return 0, math.inf
+    return (math.ceil(size * threshold / (2 - threshold) - 1e-9),
+            math.floor(size * (2 - threshold) / threshold + 1e-9))
+
+
+def min_shared(size, threshold):
+    '''returns the fewest n-grams that a name of size n-grams shares with a
+    name whose Dice score with it is at least threshold (at least 1)
+    '''
+    smallest = size_bounds(size, threshold)[0]
+    return max(math.ceil(threshold * (size + smallest) / 2 - 1e-9), 1)
+
+
+class NgramIndex(object):
+    '''an index of names by their n-grams:
+
+        index = NgramIndex(known_names)
+        positions, scores = index.match(names, threshold=0.75)
+    '''
+
+    def __init__(self, names, n=NGRAM_SIZE, max_postings=MAX_POSTINGS):
+        self.names = list(names)
+        self.n = n
+        self.max_postings = max_postings
+        self._vocabulary = {}
+
+        grams, ids = [], []
+        self._sizes = np.zeros(len(self.names), dtype=np.int64)
+        for i, name in enumerate(self.names):
+            name_grams = ngrams(name, n)
+            self._sizes[i] = len(name_grams)
+            for gram in name_grams:
+                grams.append(self._vocabulary.setdefault(
+                    gram, len(self._vocabulary)))
+                ids.append(i)
+
+        # n-grams of name i are self._grams[self._starts[i]:][:sizes[i]]
+        self._grams = np.array(grams, dtype=np.int64)
+        self._starts = np.cumsum(self._sizes) - self._sizes
+
+        # postings: the names that have n-gram g are
+        # self._postings[self._indptr[g]:self._indptr[g + 1]]
+        order = np.argsort(self._grams, kind='stable')
+        self._postings = np.array(ids, dtype=np.int64)[order]
+        self._frequency = np.bincount(self._grams,
+                                      minlength=len(self._vocabulary))
+        self._indptr = np.zeros(len(self._vocabulary) + 1, dtype=np.int64)
+        np.cumsum(self._frequency, out=self._indptr[1:])
+
+    def match(self, queries, threshold=0.0, max_pairs=MAX_PAIRS):
+        '''returns a tuple of arrays (positions, scores) with the position in
+        names of the closest name to every query and its score. Position is
+        -1 and score 0 if no name scores at least threshold. Of names with
+        the same score, the first one is returned
+        '''
+        queries = list(queries)
+        positions = np.full(len(queries), -1, dtype=np.int64)
+        scores = np.zeros(len(queries))
+        if not self.names:
+            return positions, scores
+
+        # the n-grams of every query (-1 if not in the index), its rare
+        # n-grams that find the candidates and the number of its n-grams in
+        # the index that are not counted (not rare or too frequent)
+        grams, prefixes = [], []
+        uncounted = np.zeros(len(queries), dtype=np.int64)
+        work = np.zeros(len(queries), dtype=np.int64)
+        for i, query in enumerate(queries):
+            query_grams = sorted(
+                (self._vocabulary.get(gram, -1) for gram in
+                 ngrams(query, self.n)),
+                key=lambda g: 0 if g < 0 else self._frequency[g])
+            grams.append(query_grams)
+            size = len(query_grams)
+            prefix = [g for g in query_grams[
+                :size - min_shared(size, threshold) + 1]
+                if g >= 0 and self._frequency[g] <= self.max_postings]
+            prefixes.append(prefix)
+            uncounted[i] = size - query_grams.count(-1) - len(prefix)
+            work[i] = self._frequency[prefix].sum()
+
+        # batches of queries with up to max_pairs candidates, at least one
+        # query each
+        max_rows = max(MAX_TABLE // max(len(self.names),
+                                        len(self._vocabulary)), 1)
+        start = 0
+        while start < len(queries):
+            end = start + min(max(int(np.searchsorted(
+                np.cumsum(work[start:]), max_pairs, side='right')), 1),
+                max_rows)
+            batch = slice(start, end)
+            positions[batch], scores[batch] = self._match_batch(
+                grams[batch], prefixes[batch], uncounted[batch], threshold)
+            start = end
+        return positions, scores
+
+    def _match_batch(self, grams, prefixes, uncounted, threshold):
+        positions = np.full(len(grams), -1, dtype=np.int64)
+        scores = np.zeros(len(grams))
+        sizes = np.array([len(query_grams) for query_grams in grams],
+                         dtype=np.int64)
+
+        # candidates: the names of the rare n-grams of every query
+        rows = np.repeat(np.arange(len(grams)),
+                         [len(prefix) for prefix in prefixes])
+        prefixes = np.array([g for prefix in prefixes for g in prefix],
+                            dtype=np.int64)
+        rows, candidates = self._expand(
+            rows, self._indptr[prefixes], self._frequency[prefixes],
+            self._postings)
+        # the number of rare n-grams of every pair
+        keys = rows * len(self.names) + candidates
+        counts = np.bincount(keys, minlength=len(grams) * len(self.names))
+
+        # names that cannot score threshold: a score of threshold needs
+        # threshold * (n-grams of both) / 2 shared n-grams, and they share
+        # at most the rare ones, the uncounted ones and all of the name.
+        # This also drops names with too few or too many n-grams (see
+        # size_bounds)
+        names = self._sizes[candidates]
+        shared = np.minimum(counts[keys] + uncounted[rows], names)
+        keep = 2 * shared >= threshold * (sizes[rows] + names) - 1e-9
+
+        # every pair once, sorted by query and name
+        pairs = np.zeros(len(counts), dtype=bool)
+        pairs[keys[keep]] = True
+        rows, candidates = np.divmod(np.flatnonzero(pairs), len(self.names))
+        if not len(rows):
+            return positions, scores
+
+        # shared n-grams of every pair: the n-grams of the candidate that
+        # are in the table of the n-grams of the queries
+        has_gram = np.zeros((len(grams), len(self._vocabulary)), dtype=bool)
+        for row, query_grams in enumerate(grams):
+            has_gram[row, [g for g in query_grams if g >= 0]] = True
+        pair_ids, name_grams = self._expand(
+            np.arange(len(rows)), self._starts[candidates],
+            self._sizes[candidates], self._grams)
+        shared = np.bincount(pair_ids,
+                             weights=has_gram[rows[pair_ids], name_grams],
+                             minlength=len(rows))
+        dice = 2 * shared / (sizes[rows] + self._sizes[candidates])
+
+        keep = dice >= threshold
+        rows, candidates, dice = rows[keep], candidates[keep], dice[keep]
+        if not len(rows):
+            return positions, scores
+
+        # best candidate of every query: the pairs are sorted by query and
+        # name, so the first pair with the highest score of the query
+        found, starts, counts = np.unique(rows, return_index=True,
+                                          return_counts=True)
+        highest = np.repeat(np.maximum.reduceat(dice, starts), counts)
+        best = np.flatnonzero(dice == highest)
+        best = best[np.unique(rows[best], return_index=True)[1]]
+        positions[found] = candidates[best]
+        scores[found] = dice[best]
+        return positions, scores
+
+    @staticmethod
+    def _expand(rows, starts, lengths, values):
+        '''returns (rows, values) with a pair for each of the lengths values
+        from starts of every row
+        '''
+        offsets = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        return (np.repeat(rows, lengths),
+                values[np.repeat(starts, lengths) + offsets])
@@ -4,111 +4,229 @@ Use the main() function.
 '''
 
 import bs4
+import io
 import re
 import os
 import logging
+from lxml import etree
 from bmt_parser.MyError import MyError
+import bmt_parser.config as cf
+import bmt_parser.metrics as metrics
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-stream_handler = logging.StreamHandler()
-logger.addHandler(stream_handler)
 
-file_handler = logging.FileHandler('parse.log')
-file_handler.setLevel(logging.WARNING)
-logger.addHandler(file_handler)
+# engines for reading the alto files:
+#  - bs4: loads the whole page into a BeautifulSoup tree
+#  - lxml: streams the page with lxml.etree.iterparse, keeping only the
+#    TextBlocks that are needed
+ENGINES = cf.ALTO_ENGINES
 
+DIGITS = re.compile('[0-9]+')
 
-def main(mets, alto_dir):
+# separates the FILEID and the TextBlock ID in a reference, see get_references
+REFERENCE_SEP = '#'
+
+
+def main(mets, alto_dir, engine='bs4', files=None):
     '''
-    @param mets: dictionary that is the result of the parse_mets module
+    @param mets: the records.Issue that is the result of the parse_mets
+      module
+    @param engine: one of ENGINES
+    @param files: dict {file name: bytes} of the files in alto_dir if they
+      were already read, see the prefetch module
     '''
-    # organize the mets subsections by file
-    tf = _by_file(mets)
+    if engine not in ENGINES:
+        raise ValueError('unknown alto engine {}'.format(engine))
+
+    with metrics.stage('parse_alto'):
+        # organize the mets subsections by file
+        tf = _by_file(mets)
+        index = _index_alto_dir(alto_dir, files)
+
+        # get the text for each subsection
+        for alto_file in tf:
+            filepath = _find_alto_file(alto_file, alto_dir, index)
+            if files is None:
+                source = filepath
+                metrics.count('bytes_read', os.path.getsize(filepath))
+            else:
+                data = files[os.path.basename(filepath)]
+                source = io.BytesIO(data)
+                metrics.count('bytes_read', len(data))
+            metrics.count('textblocks', len(tf[alto_file]))
+
+            texts = _get_texts(source, [loc for loc, _, _ in tf[alto_file]],
+                               engine)
+            tf[alto_file] = [(loc, section_id, name, texts[loc])
+                             for loc, section_id, name in tf[alto_file]]
+
+    return _by_section(tf)
 
-    # get the text for each subsection
+
+def get_references(mets):
+    '''like main, but returns the alto locations of the subsections instead
+    of their text, without reading the alto files. Every location is a
+    reference "FILEID#BEGIN" (see format_reference), the references of a
+    subsection are separated by spaces and are in the order main joins the
+    texts. Use get_text to read the text later.
+    '''
+    tf = _by_file(mets)
     for alto_file in tf:
-        root = _get_alto_xml(alto_file, alto_dir)
+        tf[alto_file] = [(loc, section_id, name,
+                          format_reference(alto_file, loc))
+                         for loc, section_id, name in tf[alto_file]]
+    return _by_section(tf)
+
+
+def format_reference(file, location):
+    return '{}{}{}'.format(file, REFERENCE_SEP, location)
+
+
+def parse_references(references):
+    '''returns a list of (file, location) tuples from the references of a
+    subsection
+    '''
+    return [tuple(ref.split(REFERENCE_SEP, 1)) for ref in references.split()]
+
+
+def get_text(references, alto_dir, engine='bs4', index=None):
+    '''returns the text of a subsection from its references (see
+    get_references), the same text main returns
+
+    @param alto_dir: alto dir of the issue
+    @param index: index of the alto dir, see _index_alto_dir. Pass it when
+      reading several subsections of an issue
+    '''
+    references = parse_references(references)
+    if index is None:
+        index = _index_alto_dir(alto_dir)
+
+    by_file = {}
+    for file, location in references:
+        by_file.setdefault(file, []).append(location)
+
+    texts = {}
+    for file, locations in by_file.items():
+        filepath = _find_alto_file(file, alto_dir, index)
+        for location, text in _get_texts(filepath, locations,
+                                         engine).items():
+            texts[(file, location)] = text
 
-        # getting the text for each section and subsection
-        for subsection in tf[alto_file]:
-            text = _get_text_from_alto(root, subsection['loc'])
-            subsection['text'] = text
+    return ' '.join([texts[ref] for ref in references])
 
+
+def _by_section(tf):
+    '''returns the texts of the subsections organized by section id, from
+    the subsections organized by file
+
+    @param tf: dict {file: list of (location, section id, subsection name,
+      text) tuples}
+    '''
     # flatten the file
     flat = []
     for file in tf:
         flat.extend(tf[file])
     # order alto file by location
-    flat = sorted(flat, key=lambda e: e['loc'])
+    flat = sorted(flat, key=lambda e: e[0])
 
     # organize by section id
     by_section = {}
-    for subsection in flat:
-        s_id = subsection['section_id']
+    for _, s_id, name, text in flat:
         if s_id not in by_section:
             by_section[s_id] = {}
 
-        name = subsection['subsection']
-        if subsection['subsection'] not in by_section[s_id]:
-            by_section[s_id][name] = subsection['text']
+        if name not in by_section[s_id]:
+            by_section[s_id][name] = text
         else:
-            by_section[s_id][name] = ' '.join([by_section[s_id][name],
-                                               subsection['text']])
+            by_section[s_id][name] = ' '.join([by_section[s_id][name], text])
 
     return by_section
 
 
-def _flatten_section(elem):
-    result = []
+def _by_file(mets):
+    '''returns the subsections of the sections of an issue organized by
+    file, as a dict {file: list of (location, section id, subsection name)
+    tuples}
+    '''
+    by_file = {}
+    for section in mets.sections:
+        for name, locations in section.subsections.items():
+            if locations:
+                for location in locations:
+                    if location.file not in by_file:
+                        by_file[location.file] = []
+                    by_file[location.file].append(
+                        (location.loc, section.section_id, name))
 
-    names = elem['subsections'].keys()
-    for name in names:
-        subsection = elem['subsections'][name]
-        if subsection:
-            for loc in subsection:
-                data = {}
-                data['subsection'] = name
-                data['section_id'] = elem['section_id']
-                data['file'] = loc['file']
-                data['loc'] = loc['loc']
-                result.append(data)
-    return result
+    return by_file
 
 
-def _by_file(mets):
-    mets = [item for sublist in mets['sections']
-            for item in _flatten_section(sublist)]
+def _get_alto_xml(name, path, index=None):
+    return _read_alto_xml(_find_alto_file(name, path, index))
 
-    by_file = {}
-    for subsect in mets:
-        file = subsect['file']
-        if file not in by_file:
-            by_file[file] = []
-        del subsect['file']
-        by_file[file].append(subsect)
 
-    return by_file
+def _read_alto_xml(source):
+    '''@param source: path of the alto file, or a binary file object'''
+    if not isinstance(source, str):
+        return bs4.BeautifulSoup(source, 'xml')
+    with open(source, 'r') as file:
+        return bs4.BeautifulSoup(file, 'xml')
 
 
-def _get_alto_xml(name, path):
-    numbers = re.search('[0-9]+', name)
-    numbers = name[numbers.start():numbers.end()]
-    numbers = numbers[1:]
+def _index_alto_dir(path, files=None):
+    '''lists an alto dir once and indexes its files by page number, which is
+    the last group of digits in the file name (0001 in
+    "bmtnaap_1910-03_01_0001.alto.xml")
+
+    :param files: names of the files in path, if they are known. The dir is
+      listed otherwise
+    :returns: dict with the file names ("files") and a dict of page number to
+      list of file names ("by_number")
+    '''
+    files = os.listdir(path) if files is None else list(files)
+    by_number = {}
+    for file in files:
+        numbers = DIGITS.findall(file)
+        if numbers:
+            by_number.setdefault(numbers[-1], []).append(file)
+    return {'files': files, 'by_number': by_number}
 
-    files = os.listdir(path)
 
-    r = re.compile(numbers)
-    found = list(filter(r.search, files))
-    if len(found) is 0:
+def _find_alto_file(name, path, index=None):
+    '''returns the path of the alto file that has the FILEID "name".
+
+    Uses the index of the alto dir (see _index_alto_dir). Names that are not
+    a page number in the index are searched for in all file names.
+    '''
+    if index is None:
+        index = _index_alto_dir(path)
+
+    numbers = DIGITS.search(name).group()
+    numbers = numbers[1:]
+
+    found = index['by_number'].get(numbers)
+    if not found:
+        found = [file for file in index['files'] if numbers in file]
+    if len(found) == 0:
         raise MyError('file for {} not found'.format(name))
     elif len(found) > 1:
         raise MyError('multiple files for {} found'.format(name))
     else:
-        filepath = os.path.join(path, found[0])
-        return bs4.BeautifulSoup(open(filepath, 'r'), 'xml')
+        return os.path.join(path, found[0])
+
+
+def _get_texts(source, locations, engine='bs4'):
+    '''returns a dict {location: text} for the TextBlocks of an alto file
+
+    @param source: path of the alto file, or a binary file object
+    '''
+    if engine == 'lxml':
+        return _get_texts_iterparse(source, locations)
+    root = _read_alto_xml(source)
+    return {location: _get_text_from_alto(root, location)
+            for location in locations}
 
 
 def _get_text_from_alto(alto_xml, location):
@@ -118,20 +236,68 @@ def _get_text_from_alto(alto_xml, location):
     elif len(block) == 0:
         raise MyError('no TextBlock for {}'.format(location))
 
-    strings = block[0].find_all('String')
-    remove = []
+    return _join_strings([s.attrs for s in block[0].find_all('String')])
 
-    for idx in range(len(strings)):
-        s = strings[idx]
+
+def _get_texts_iterparse(filepath, locations):
+    '''returns a dict {location: text} for the TextBlocks with the given IDs.
+
+    The file is read in a single pass that stops once all the blocks have been
+    found, and elements are cleared as soon as they are processed. Because of
+    the early stop, a duplicated TextBlock is only noticed if it comes before
+    the last of the wanted blocks.
+
+    @param filepath: path of the alto file, or a binary file object
+    '''
+    if isinstance(filepath, str):
+        # opening the file here, lxml would not close it on the early stop
+        with open(filepath, 'rb') as f:
+            return _get_texts_iterparse(f, locations)
+
+    wanted = set(locations)
+    texts = {}
+
+    context = etree.iterparse(filepath, events=('end',), tag='{*}TextBlock')
+    for event, elem in context:
+        location = elem.get('ID')
+        if location in wanted:
+            if location in texts:
+                raise MyError('more than one TextBlock for {}'
+                              .format(location))
+            texts[location] = _join_strings(
+                [s.attrib for s in elem.iter('{*}String')])
+
+        # freeing memory taken by this and the preceding elements
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+        if len(texts) == len(wanted):
+            break
+    del context
+
+    for location in locations:
+        if location not in texts:
+            raise MyError('no TextBlock for {}'.format(location))
+    return texts
+
+
+def _join_strings(strings):
+    '''joins the words of a TextBlock, resolving hyphenated words.
+
+    @param strings: list of attribute mappings of the String elements
+    '''
+    words = []
+    for s in strings:
         hyphen = s.get('SUBS_TYPE')
         if hyphen:
             if hyphen == 'HypPart1':
-                s['CONTENT'] = s['SUBS_CONTENT']
+                words.append(s['SUBS_CONTENT'])
             elif hyphen == 'HypPart2':
-                remove.append(idx)
+                continue
             else:
                 raise MyError('more than two hyphen parts? String: {}'
                               .format(s['CONTENT']))
-    strings = [i['CONTENT'].replace('\t', ' ' * 4)
-               for j, i in enumerate(strings) if j not in remove]
-    return ' '.join(strings)
+        else:
+            words.append(s['CONTENT'])
+    return ' '.join([w.replace('\t', ' ' * 4) for w in words])
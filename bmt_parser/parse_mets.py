@@ -14,17 +14,13 @@ import logging
 import os
 import re
 from bmt_parser.MyError import MyError
+import bmt_parser.config as cf
+import bmt_parser.diagnostics as diagnostics
+import bmt_parser.metrics as metrics
+import bmt_parser.records as records
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-stream_handler = logging.StreamHandler()
-logger.addHandler(stream_handler)
-
-file_handler = logging.FileHandler('parse.log')
-file_handler.setLevel(logging.WARNING)
-logger.addHandler(file_handler)
 
 
 KNOWN_SUBS = ['Head', 'Subhead', 'Byline', 'Copy', 'TextContent',
@@ -35,66 +31,88 @@ KNOWN_SUBS = ['Head', 'Subhead', 'Byline', 'Copy', 'TextContent',
 RELEVANT_SUBS = ['Head', 'Subhead', 'Byline', 'Copy']
 VALID_SECTIONS = ['advertisement', 'parent', 'subsection', 'flat', 'image']
 
+# engines for parsing the mets file:
+#  - bs4: BeautifulSoup, the reference implementation in this module
+#  - lxml: lxml with compiled XPath expressions, see parse_mets_lxml
+ENGINES = cf.METS_ENGINES
 
-def main(filepath):
+
+def main(filepath, data=None, engine='bs4'):
     '''returns the mets (metadata) info on an issue:
       - issue date, volume, etc
       - list of sections (texts, images) and their metadata
 
     :param filepath: path to the mets file
-    :returns: a nested dictionary
+    :param data: the bytes of the mets file if they were already read, see
+      the prefetch module
+    :param engine: one of ENGINES
+    :returns: a records.Issue with the sections as records.Section
     '''
+    if engine == 'lxml':
+        # imported here because parse_mets_lxml uses the settings above
+        import bmt_parser.parse_mets_lxml as mets_lxml
+        return mets_lxml.main(filepath, data)
+    elif engine != 'bs4':
+        raise ValueError('unknown mets engine {}'.format(engine))
+
+    with metrics.stage('parse_mets'):
+        if data is None:
+            with open(filepath, 'r') as file:
+                root = bs4.BeautifulSoup(file, 'xml')
+            metrics.count('bytes_read', os.path.getsize(filepath))
+        else:
+            root = bs4.BeautifulSoup(data, 'xml')
+            metrics.count('bytes_read', len(data))
 
-    result = {}
-
-    with open(filepath, 'r') as file:
-        root = bs4.BeautifulSoup(file, 'xml')
-
-    filename = os.path.split(filepath)[1]
+        filename = os.path.split(filepath)[1]
 
-    # getting data
-    result.update(_get_issue_metadata(root, filename))
-    result['sections'] = _get_issue_sections(root, filename)
+        # getting data
+        dmdsec = _only_one(root, 'dmdSec', filename)
+        result = records.Issue(
+            sections=_get_issue_sections(root, dmdsec, filename),
+            **_get_issue_metadata(dmdsec, filename))
 
+    metrics.count('sections', len(result.sections))
     return result
 
 
-def _get_issue_metadata(root, filename):
+def _get_issue_metadata(dmdsec, filename):
     '''returns metadata (title, date...) in form of a dictionary
     '''
 
     result = {}
-    dmdsec = _only_one(root, 'dmdSec', filename)
     part = _only_one(dmdsec, 'part', filename, {'type': 'issue'})
 
-    result['volume'] = part.find('detail', type='volume').number.string
-    result['number'] = part.find('detail', type='number').number.string
-    result['date'] = dmdsec.originInfo.find('dateIssued', keyDate='yes').string
+    result['volume'] = _string(part.find('detail', type='volume').number)
+    result['number'] = _string(part.find('detail', type='number').number)
+    result['date'] = _string(dmdsec.originInfo.find('dateIssued',
+                                                    keyDate='yes'))
     return result
 
 
-def _get_issue_sections(root, filename):
+def _get_issue_sections(root, dmdsec, filename):
     '''returns section (texts, images) data as a list
     '''
-    # dmdSec was already checked
-    dmdsec = _only_one(root, 'dmdSec', filename)
     mods = _only_one(dmdsec, 'mods', filename)
     structMap = _only_one(root, 'structMap', filename,
                           {'LABEL': 'Logical Structure'})
+    index = _index_struct_map(structMap)
 
     result = []
     sections = mods.find_all('relatedItem')
     for sec in sections:
         type = _get_section_type(sec, filename)
         if type in VALID_SECTIONS:
-            data = _parse_section(sec, type, structMap, filename)
+            data = _parse_section(sec, type, index, filename)
             result.append(data)
 
     return result
 
 
-def _parse_section(section, type, structMap, filename):
-    '''returns data on a single section as a dict
+def _parse_section(section, type, index, filename):
+    '''returns data on a single section as a records.Section
+
+    :param index: index of the structMap divs, see _index_struct_map
     '''
     result = {}
 
@@ -102,7 +120,7 @@ def _parse_section(section, type, structMap, filename):
     result['title'] = ' '.join([
         part.string for part in section.titleInfo.find_all(True)])
     result['authors'] = _get_names(section, type)
-    result['type_of_resource'] = section.find('typeOfResource').string
+    result['type_of_resource'] = _string(section.find('typeOfResource'))
     result['section_id'] = section['ID']
 
     # text content
@@ -111,7 +129,7 @@ def _parse_section(section, type, structMap, filename):
         remaining = RELEVANT_SUBS
     else:
         text_cont = 'SponsoredAd' if type == 'advertisement' else 'TextContent'
-        alto_locs = structMap.find('div', TYPE=text_cont, DMDID=section['ID'])
+        alto_locs = index.get((text_cont, section['ID']))
         if not alto_locs:
             raise MyError('section {} in file {} doesnt have a div with text '
                           'content'.format(section['ID'], filename))
@@ -138,14 +156,26 @@ def _parse_section(section, type, structMap, filename):
             if div['TYPE'] in result:
                 raise MyError('duplicate alto location for {}!'.
                               format(div['TYPE']))
-            result['subsections'][div['TYPE']] = _get_alto_locations(div)
+            result['subsections'][records.intern(div['TYPE'])] = \
+                _get_alto_locations(div)
 
         remaining = set(RELEVANT_SUBS) - set(div_types)
 
     for r in remaining:
         result['subsections'][r] = None
 
-    return result
+    return records.Section(**result)
+
+
+def _index_struct_map(structMap):
+    '''returns a dict {(TYPE, DMDID): div} of the divs in the structMap that
+    have a DMDID. If there are several divs with the same TYPE and DMDID, the
+    first one is kept, like structMap.find would return it
+    '''
+    index = {}
+    for div in structMap.find_all('div', DMDID=True):
+        index.setdefault((div.get('TYPE'), div['DMDID']), div)
+    return index
 
 
 def _get_names(section, type):
@@ -162,6 +192,14 @@ def _get_names(section, type):
         return None
 
 
+def _string(tag):
+    '''returns the string of a tag as a plain str. bs4 strings keep a
+    reference to the whole tree, so they are expensive to keep or pickle
+    '''
+    string = tag.string
+    return None if string is None else str(string)
+
+
 def _only_one(root, tag_name, filename, optional_attr={}):
     '''checks if root contains tag and returns it. Raises errors if no tag or
     more than one tag.
@@ -194,8 +232,10 @@ def _get_section_type(section, filename):
     '''returns section type and None if it is an invalid section
     '''
     if not _test_section(section):
-        logger.warning('ignoring section: {} {}'
-                       .format(section.name, section.attrs))
+        diagnostics.record('ignored_section',
+                           'ignoring section {} (type {}, ID {}) in {}',
+                           section.name, section.get('type'),
+                           section.get('ID'), filename)
         return None
 
     resource_type = section.find('typeOfResource').string
@@ -222,27 +262,33 @@ def _get_section_type(section, filename):
         else:
             return 'flat'
     else:
-        logger.warning('unknown section {} type in file {}. Resource type: {},'
-                       'genre: {}'
-                       .format(section['ID'], filename, resource_type, genre))
+        diagnostics.record('unknown_section_type',
+                           'unknown section {} type in file {}. Resource '
+                           'type: {}, genre: {}', section['ID'], filename,
+                           resource_type, genre)
         return 'unknown'
 
 
 def _get_alto_locations(section):
-    '''returns alto locations as a list. These are used when parsing alto file
+    '''returns alto locations as a list of records.Location. These are used
+    when parsing alto file
     '''
     areas = section.find_all('area')
     if len(areas) == 0:
         return None
-    return [{'file': area['FILEID'], 'loc': area['BEGIN']} for area in areas]
+    return [records.Location(records.intern(area['FILEID']), area['BEGIN'])
+            for area in areas]
 
 
 if __name__ == '__main__':
     import argparse
     import json
+    import bmt_parser.cli as cli
     parser = argparse.ArgumentParser()
     parser.add_argument('--path', '-p', dest='file_path', required=True)
     args = parser.parse_args()
+    cli.configure_logging()
 
     res = main(args.file_path)
-    print(json.dumps(res))
+    diagnostics.log_summary()
+    print(json.dumps(res, default=lambda record: record.__getstate__()))
@@ -0,0 +1,292 @@
+'''
+Parses the mets file of an issue with lxml and compiled XPath expressions.
+Returns the same as parse_mets.main, which stays the reference
+implementation: the functions here follow the ones in parse_mets, where
+BeautifulSoup's find and find_all are the XPath expressions below.
+
+Unlike BeautifulSoup, the expressions match the mets and mods namespaces,
+not just the names of the tags.
+
+Use parse_mets.main(filepath, engine='lxml').
+'''
+
+import logging
+import os
+import re
+from lxml import etree
+from bmt_parser.MyError import MyError
+import bmt_parser.diagnostics as diagnostics
+import bmt_parser.metrics as metrics
+import bmt_parser.parse_mets as mets
+import bmt_parser.records as records
+
+
+logger = logging.getLogger(__name__)
+
+
+NAMESPACES = {'mets': 'http://www.loc.gov/METS/',
+              'mods': 'http://www.loc.gov/mods/v3'}
+
+
+def _xpath(path):
+    return etree.XPath(path, namespaces=NAMESPACES)
+
+
+# "(...)[1]" is the first match in document order, like find() in bs4
+DMDSEC = _xpath('//mets:dmdSec')
+STRUCT_MAP = _xpath("//mets:structMap[@LABEL='Logical Structure']")
+MODS = _xpath('.//mods:mods')
+ISSUE_PART = _xpath(".//mods:part[@type='issue']")
+VOLUME = _xpath("(.//mods:detail[@type='volume'])[1]")
+NUMBER = _xpath("(.//mods:detail[@type='number'])[1]")
+FIRST_NUMBER = _xpath('(.//mods:number)[1]')
+ORIGIN_INFO = _xpath('(.//mods:originInfo)[1]')
+DATE_ISSUED = _xpath("(.//mods:dateIssued[@keyDate='yes'])[1]")
+RELATED_ITEMS = _xpath('.//mods:relatedItem')
+HAS_CONSTITUENTS = _xpath(
+    "boolean(.//mods:relatedItem[@type='constituent'])")
+TYPE_OF_RESOURCE = _xpath('(.//mods:typeOfResource)[1]')
+GENRE = _xpath('(.//mods:genre)[1]')
+TITLE_INFO = _xpath('(.//mods:titleInfo)[1]')
+TITLE = _xpath('(.//mods:title)[1]')
+NAMES = _xpath('mods:name')
+DISPLAY_FORM = _xpath('(.//mods:displayForm)[1]')
+ROLE = _xpath('(.//mods:role)[1]')
+ROLE_TERM = _xpath('(.//mods:roleTerm)[1]')
+STRUCT_DIVS = _xpath('.//mets:div[@DMDID]')
+CHILD_DIVS = _xpath('mets:div')
+AREAS = _xpath('.//mets:area')
+
+
+def main(filepath, data=None):
+    '''returns the mets (metadata) info on an issue, see parse_mets.main'''
+
+    with metrics.stage('parse_mets'):
+        if data is None:
+            root = etree.parse(filepath).getroot()
+            metrics.count('bytes_read', os.path.getsize(filepath))
+        else:
+            root = etree.fromstring(data)
+            metrics.count('bytes_read', len(data))
+
+        filename = os.path.split(filepath)[1]
+
+        # getting data
+        dmdsec = _only_one(DMDSEC(root), 'dmdSec', filename)
+        result = records.Issue(
+            sections=_get_issue_sections(root, dmdsec, filename),
+            **_get_issue_metadata(dmdsec, filename))
+
+    metrics.count('sections', len(result.sections))
+    return result
+
+
+def _get_issue_metadata(dmdsec, filename):
+    result = {}
+    part = _only_one(ISSUE_PART(dmdsec), 'part', filename)
+
+    result['volume'] = _string(_first(FIRST_NUMBER, _first(VOLUME, part)))
+    result['number'] = _string(_first(FIRST_NUMBER, _first(NUMBER, part)))
+    result['date'] = _string(_first(DATE_ISSUED,
+                                    _first(ORIGIN_INFO, dmdsec)))
+    return result
+
+
+def _get_issue_sections(root, dmdsec, filename):
+    mods = _only_one(MODS(dmdsec), 'mods', filename)
+    structMap = _only_one(STRUCT_MAP(root), 'structMap', filename)
+    index = _index_struct_map(structMap)
+
+    result = []
+    for sec in RELATED_ITEMS(mods):
+        type = _get_section_type(sec, filename)
+        if type in mets.VALID_SECTIONS:
+            data = _parse_section(sec, type, index, filename)
+            result.append(data)
+
+    return result
+
+
+def _parse_section(section, type, index, filename):
+    result = {}
+
+    # metadata: title, author name, etc
+    result['title'] = ' '.join([
+        _string(part) for part in _first(TITLE_INFO, section)
+        .iterdescendants(etree.Element)])
+    result['authors'] = _get_names(section, type)
+    result['type_of_resource'] = _string(_first(TYPE_OF_RESOURCE, section))
+    result['section_id'] = section.attrib['ID']
+
+    # text content
+    result['subsections'] = {}
+    if type == 'image':
+        remaining = mets.RELEVANT_SUBS
+    else:
+        text_cont = 'SponsoredAd' if type == 'advertisement' else 'TextContent'
+        alto_locs = index.get((text_cont, section.attrib['ID']))
+        if alto_locs is None:
+            raise MyError('section {} in file {} doesnt have a div with text '
+                          'content'.format(section.attrib['ID'], filename))
+        divs = CHILD_DIVS(alto_locs)
+
+        div_types = set([div.attrib['TYPE'] for div in divs])
+        unknown = div_types - set(mets.KNOWN_SUBS)
+        if len(unknown) > 0:
+            msg = ('div of type {} in section {} of file {} not '
+                   'known!'.format(unknown, section.attrib['ID'], filename))
+            # quick fix for their typo
+            if 'Byline          ' in unknown:
+                for div in divs:
+                    if div.attrib['TYPE'] == 'Byline          ':
+                        div.set('TYPE', 'Byline')
+                # if there are unknown divs left, raise error
+                if (len(unknown) - 1) > 0:
+                    raise MyError(msg)
+            else:
+                raise MyError(msg)
+
+        divs = [div for div in divs
+                if div.attrib['TYPE'] in mets.RELEVANT_SUBS]
+        for div in divs:
+            if div.attrib['TYPE'] in result:
+                raise MyError('duplicate alto location for {}!'.
+                              format(div.attrib['TYPE']))
+            result['subsections'][records.intern(div.attrib['TYPE'])] = \
+                _get_alto_locations(div)
+
+        remaining = set(mets.RELEVANT_SUBS) - set(div_types)
+
+    for r in remaining:
+        result['subsections'][r] = None
+
+    return records.Section(**result)
+
+
+def _index_struct_map(structMap):
+    '''returns a dict {(TYPE, DMDID): div}, see parse_mets._index_struct_map
+    '''
+    index = {}
+    for div in STRUCT_DIVS(structMap):
+        index.setdefault((div.get('TYPE'), div.get('DMDID')), div)
+    return index
+
+
+def _get_names(section, type):
+    names = NAMES(section)
+    # if subsection, probably the author is in the parent section
+    if not names and type == 'subsection':
+        names = NAMES(section.getparent())
+    if names:
+        names_text = [_string(_first(DISPLAY_FORM, name)) for name in names
+                      if _string(_first(ROLE_TERM, _first(ROLE, name)))
+                      == 'cre']
+        names_text = [name for name in names_text if name is not None]
+        return '||'.join(names_text)
+    else:
+        return None
+
+
+def _first(xpath, elem):
+    '''returns the first match of an expression like "(...)[1]" or None.
+    Raises an AttributeError if elem is None, like bs4 does when a tag was
+    not found
+    '''
+    if elem is None:
+        raise AttributeError('no element to search for {}'.format(
+            xpath.path))
+    found = xpath(elem)
+    return found[0] if found else None
+
+
+def _string(elem):
+    '''returns the string of an element like bs4's Tag.string: its text if
+    it has no children, the string of its child if it has only one child
+    and no text, and None otherwise
+    '''
+    if elem is None:
+        raise AttributeError('no element to get the string of')
+    children = list(elem)
+    if not children:
+        return elem.text
+    if len(children) == 1 and not elem.text and not children[0].tail:
+        return _string(children[0])
+    return None
+
+
+def _only_one(tags, tag_name, filename):
+    '''checks that tags (the result of an expression) has only one tag and
+    returns it
+    '''
+    if len(tags) > 1:
+        raise MyError('more than one {tag_name} in {filename}'.format(
+            tag_name=tag_name, filename=filename))
+    elif len(tags) == 0:
+        raise MyError('no {tag_name} in {filename}'.format(
+            tag_name=tag_name, filename=filename))
+    return tags[0]
+
+
+def _test_section(section):
+    '''returns True if the given section is relevant'''
+    if section is None:
+        return False
+    if section.get('type'):
+        if section.get('type') == 'constituent':
+            return True
+    # due to input mistakes, some sections do not have type
+    elif section.get('ID'):
+        if re.search('c[0-9]{3}', section.get('ID')):
+            return True
+
+    return False
+
+
+def _get_section_type(section, filename):
+    '''returns section type and None if it is an invalid section'''
+    if not _test_section(section):
+        diagnostics.record('ignored_section',
+                           'ignoring section {} (type {}, ID {}) in {}',
+                           etree.QName(section).localname,
+                           section.get('type'), section.get('ID'), filename)
+        return None
+
+    resource_type = _string(_first(TYPE_OF_RESOURCE, section))
+    genre = _string(_first(GENRE, section)).lower()
+    title = _string(_first(TITLE, _first(TITLE_INFO, section)))
+
+    if resource_type == 'still image':
+        return 'image'
+    elif resource_type == 'text':
+        # special text section types
+        if 'advertisement' in genre:
+            return 'advertisement'
+        elif 'inhalt' in title.lower():
+            return 'contents'
+        # valid sections
+        elif HAS_CONSTITUENTS(section):
+            return 'parent'
+        elif _test_section(section.getparent()):
+            if _test_section(section.getparent().getparent()):
+                raise MyError('double nesting in section {}, file {}!'
+                              .format(section.attrib['ID'], filename))
+            return 'subsection'
+        else:
+            return 'flat'
+    else:
+        diagnostics.record('unknown_section_type',
+                           'unknown section {} type in file {}. Resource '
+                           'type: {}, genre: {}', section.attrib['ID'],
+                           filename, resource_type, genre)
+        return 'unknown'
+
+
+def _get_alto_locations(section):
+    '''returns alto locations as a list, see parse_mets._get_alto_locations
+    '''
+    areas = AREAS(section)
+    if len(areas) == 0:
+        return None
+    return [records.Location(records.intern(area.attrib['FILEID']),
+                             area.attrib['BEGIN'])
+            for area in areas]
@@ -26,96 +26,469 @@ columns:
  - Byline
  - Copy
 
+In the "references" text mode, Head, Subhead, Byline and Copy have the alto
+locations of the text instead of the text (see parse_alto.get_references),
+and there is an additional column
+
+ - alto_dir: the alto dir of the issue
+
+The text of the sections that are needed can be loaded later with load_text.
+
+main writes the sections to a file and get_data returns them as a DataFrame.
+To use the sections in another program without either, iterate over
+iter_issues or iter_sections.
 '''
 
 import bmt_parser.parse_mets as mets
 import bmt_parser.parse_alto as alto
+import bmt_parser.archive as archive
+import bmt_parser.cache as cache
+import collections
+import io
+import itertools
 import os
 import re
 import logging
-import csv
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 import bmt_parser.config as cf
+import bmt_parser.diagnostics as diagnostics
+import bmt_parser.prefetch as prefetch
+import bmt_parser.storage as storage
+import bmt_parser.metrics as metrics
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-stream_handler = logging.StreamHandler()
-logger.addHandler(stream_handler)
-
-open('parse.log', 'w').close()  # emptying log
-file_handler = logging.FileHandler('parse.log')
-file_handler.setLevel(logging.WARNING)
-logger.addHandler(file_handler)
 
 columns = ["issue_id", "date", "volume", "number", "section_id", "title",
            "authors", "section_type", "type_of_resource", "Head", "Subhead",
            "Byline", "Copy"]
 
+# "text" stores the text of the sections, "references" the alto locations of
+# the text, which is much smaller and faster
+TEXT_MODES = ['text', 'references']
+TEXT_COLUMNS = mets.RELEVANT_SUBS
+reference_columns = columns + ['alto_dir']
+
+
+def get_issue(mets_path, alto_dir, issue_id, alto_engine='bs4',
+              text_mode='text', mets_engine='bs4'):
+    sections, error = _get_issue_or_error(mets_path, alto_dir, issue_id,
+                                          alto_engine, text_mode, mets_engine)
+    if error:
+        _report_error(mets_path, *error)
+    return sections
+
 
-def get_issue(mets_path, alto_dir, issue_id):
+def _get_issue_or_error(mets_path, alto_dir, issue_id, alto_engine='bs4',
+                        text_mode='text', mets_engine='bs4', files=None):
+    '''returns a tuple (sections, error). Errors are returned instead of
+    logged so that they can be reported by the parent process when parsing
+    with a process pool. error is None or a tuple (is_my_error, message,
+    traceback)
+
+    @param files: the bytes of the issue files if they were already read,
+      or the error raised reading them, see prefetch.read_ahead
+    '''
+    if files is None:
+        files = {'mets': None, 'alto': None}
+    start = time.perf_counter()
     try:
-        mets_data = mets.main(mets_path)
-        alto_data = alto.main(mets_data, alto_dir)
+        if isinstance(files, OSError):
+            raise files
+        issue = mets.main(mets_path, files['mets'], mets_engine)
+        if text_mode == 'references':
+            alto_data = alto.get_references(issue)
+        else:
+            alto_data = alto.main(issue, alto_dir, engine=alto_engine,
+                                  files=files['alto'])
     except Exception as e:
         if type(e).__name__ == 'MyError':
-            logger.error(str(e))
+            return None, (True, str(e), None)
         else:
-            logger.exception(mets_path + ': ' + str(e))
-        return None
+            return None, (False, str(e), traceback.format_exc())
+    finally:
+        metrics.record_issue(mets_path, time.perf_counter() - start)
 
-    # join mets and alto file
-    sections = mets_data['sections']
-    del mets_data['sections']
+    # join mets and alto file. The sections share the issue, which does not
+    # keep the sections so that there are no reference cycles
+    issue.issue_id = issue_id
+    if text_mode == 'references':
+        issue.alto_dir = os.path.abspath(alto_dir)
+    sections = issue.sections
+    issue.sections = None
     for section in sections:
-        section.update(mets_data)
-        try:
-            target = alto_data[section['section_id']]
-            section.update(target)
-        except KeyError:
-            pass
-        for subsect in section['subsections']:
-            if section['subsections'][subsect] is None:
-                section[subsect] = ''
+        section.issue = issue
+        section.texts = alto_data.get(section.section_id, {})
+        # subsections without text are empty strings, see Section.get
+        section.subsections = None
 
-        section['issue_id'] = issue_id
-        del section['subsections']
+    return sections, None
 
-    return sections
 
+def _report_error(mets_path, is_my_error, message, tb):
+    if is_my_error:
+        logger.error(message)
+    else:
+        # same output as logger.exception in the process that raised
+        logger.error('%s\n%s', mets_path + ': ' + message, tb.rstrip('\n'))
+
+
+def _issue_worker(item):
+    '''parses an issue in a worker process. Returns the metrics and the
+    diagnostics of the worker together with the result, see metrics.collect
+    and diagnostics.collect
+
+    @param item: tuple (task, files), files as in _get_issue_or_error
+    '''
+    task, files = item
+    metrics.reset()
+    diagnostics.reset()
+    return _get_issue_or_error(*task, files=files) + (
+        (metrics.collect(), diagnostics.collect()),)
 
-def main(data_dir, output_path):
-    # writing column names
-    csv_file = csv.DictWriter(open(output_path, 'w'), columns,
-                              delimiter=cf.CSV_SEP)
-    csv_file.writeheader()
 
-    # getting data out
-    issue_id = 1
+def find_issues(data_dir):
+    '''returns a list of (mets_path, alto_dir) tuples, one for each issue
+    in data_dir. data_dir can also be a zip or tar archive, see the archive
+    module
+    '''
+    if archive.is_archive(data_dir):
+        with archive.Archive(data_dir) as source:
+            return source.find_issues()
 
+    issues = []
     for dirpath, dirnames, filenames in os.walk(data_dir):
         if not dirnames:  # starting at lowest level dir
             # alto files
             if not re.search('alto$', dirpath):
-                logger.warning('no alto dir in {}'.format(dirpath))
+                diagnostics.record('no_alto_dir', 'no alto dir in {}',
+                                   dirpath)
                 continue
             alto_dir = dirpath
 
             # mets file
             mets_dir = os.path.split(alto_dir)[0]
             mets_file = [file for file in os.listdir(mets_dir)
-                         if re.search('mets\.xml$', file)]
+                         if re.search(r'mets\.xml$', file)]
             if not mets_file:
-                logger.warning('no mets file for {}'.format(mets_dir))
+                diagnostics.record('no_mets_file', 'no mets file for {}',
+                                   mets_dir)
                 continue
             else:
-                mets_path = os.path.join(mets_dir, mets_file[0])
+                issues.append((os.path.join(mets_dir, mets_file[0]),
+                               alto_dir))
+    return issues
+
+
+def main(data_dir, output_path, alto_engine='bs4', workers=1,
+         cache_dir=None, hash_files=False, data_format='csv',
+         text_mode='text', read_ahead=0,
+         read_ahead_bytes=cf.READ_AHEAD_BYTES, mets_engine='bs4'):
+    '''
+    @param data_dir: dir with the issues, or a zip or tar archive of it
+    @param alto_engine: engine for reading alto files, see parse_alto.ENGINES
+    @param workers: number of processes parsing issues. Output is the same
+      for any number of workers
+    @param cache_dir: if given, parsed issues are cached in this dir and only
+      new or changed issues are parsed. See the cache module
+    @param hash_files: detect changed files by their content instead of size
+      and modification time
+    @param data_format: format of the output, see storage.FORMATS
+    @param text_mode: one of TEXT_MODES
+    @param read_ahead: number of issues whose files are read in the
+      background while an issue is parsed, 0 for none. Only used with one
+      worker, see prefetch.read_ahead
+    @param read_ahead_bytes: maximum size of the files read ahead
+    @param mets_engine: engine for parsing mets files, see
+      parse_mets.ENGINES. Output is the same for both engines
+    '''
+    with metrics.stage('parse_xml'), \
+            storage.TableWriter(output_path, _columns(text_mode),
+                                data_format) as writer:
+        for sections in iter_issues(data_dir, alto_engine, workers,
+                                    cache_dir, hash_files, text_mode,
+                                    read_ahead, read_ahead_bytes,
+                                    mets_engine):
+            writer.write_rows(sections)
+
+
+def get_data(data_dir, alto_engine='bs4', workers=1, cache_dir=None,
+             hash_files=False, text_mode='text', read_ahead=0,
+             read_ahead_bytes=cf.READ_AHEAD_BYTES, mets_engine='bs4'):
+    '''parses like main, but returns the data as a DataFrame instead of
+    writing it. Empty strings are missing values, as they are when main's
+    output is read with pandas.
+    '''
+    import pandas as pd
+    keys = _columns(text_mode)
+    with metrics.stage('parse_xml'):
+        # tuples of the values, smaller than the dicts of iter_issues
+        rows = [section.row(keys)
+                for sections in _iter_records(data_dir, alto_engine, workers,
+                                              cache_dir, hash_files,
+                                              text_mode, read_ahead,
+                                              read_ahead_bytes, mets_engine)
+                for section in sections]
+
+    data = pd.DataFrame.from_records(rows, columns=keys)
+    return data.mask(data == '')
+
+
+def iter_issues(data_dir, alto_engine='bs4', workers=1, cache_dir=None,
+                hash_files=False, text_mode='text', read_ahead=0,
+                read_ahead_bytes=cf.READ_AHEAD_BYTES, mets_engine='bs4'):
+    '''yields the sections of the issues in data_dir, one issue at a time
+    and in the order of the issue ids. The sections of an issue are a list of
+    dicts with the keys in columns (reference_columns in the "references"
+    text mode), values that were not found are empty strings. Issues that
+    could not be parsed are logged and skipped.
+
+    Only a few issues are in memory at any time, also with several workers.
+    The parameters are the same as in main.
+    '''
+    keys = _columns(text_mode)
+    for sections in _iter_records(data_dir, alto_engine, workers, cache_dir,
+                                  hash_files, text_mode, read_ahead,
+                                  read_ahead_bytes, mets_engine):
+        yield [{key: section.get(key) for key in keys}
+               for section in sections]
+
+
+def iter_sections(data_dir, alto_engine='bs4', workers=1, cache_dir=None,
+                  hash_files=False, text_mode='text', read_ahead=0,
+                  read_ahead_bytes=cf.READ_AHEAD_BYTES, mets_engine='bs4'):
+    '''like iter_issues, but yields the sections one by one'''
+    for sections in iter_issues(data_dir, alto_engine, workers, cache_dir,
+                                hash_files, text_mode, read_ahead,
+                                read_ahead_bytes, mets_engine):
+        yield from sections
+
+
+def _iter_records(data_dir, alto_engine='bs4', workers=1, cache_dir=None,
+                  hash_files=False, text_mode='text', read_ahead=0,
+                  read_ahead_bytes=cf.READ_AHEAD_BYTES, mets_engine='bs4'):
+    '''like iter_issues, but the sections are records.Section'''
+    cache_dir = _cache_dir(cache_dir, text_mode)
+    with diagnostics.summarized():
+        source = None
+        if archive.is_archive(data_dir):
+            source = archive.Archive(data_dir)
+        try:
+            tasks = _get_tasks(data_dir, alto_engine, text_mode, mets_engine,
+                               source)
+            for sections in _parse_issues(tasks, workers, cache_dir,
+                                          hash_files, read_ahead,
+                                          read_ahead_bytes, source):
+                if sections:  # None if there were problems
+                    yield sections
+        finally:
+            if source:
+                source.close()
+
+
+def load_text(data, subsections=None, alto_engine='bs4'):
+    '''returns a copy of data parsed in the "references" text mode, with the
+    text of the sections instead of the references. Select the rows that are
+    needed before, only their text is read. Every alto file is read once.
+
+    @param subsections: text columns to load, all of TEXT_COLUMNS if None
+    @param alto_engine: engine for reading alto files, see
+      parse_alto.ENGINES
+    '''
+    import pandas as pd
+    if subsections is None:
+        subsections = TEXT_COLUMNS
+    data = data.copy()
+
+    # the locations needed from every alto file
+    wanted = {}
+    for alto_dir, refs in _references(data, subsections):
+        for file, location in refs:
+            wanted.setdefault((alto_dir, file), []).append(location)
+
+    texts = {}
+    indexes = {}
+    sources = {}  # the archive of every alto dir, None if not in an archive
+    archives = {}
+    try:
+        for (alto_dir, file), locations in wanted.items():
+            if alto_dir not in indexes:
+                sources[alto_dir] = _open_archive(alto_dir, archives)
+                files = None
+                if sources[alto_dir]:
+                    files = sources[alto_dir].listdir(alto_dir)
+                indexes[alto_dir] = alto._index_alto_dir(alto_dir, files)
+            filepath = alto._find_alto_file(file, alto_dir,
+                                            indexes[alto_dir])
+            if sources[alto_dir]:
+                filepath = io.BytesIO(sources[alto_dir].read_file(filepath))
+            for location, text in alto._get_texts(filepath, set(locations),
+                                                  alto_engine).items():
+                texts[(alto_dir, file, location)] = text
+    finally:
+        for source in archives.values():
+            source.close()
+
+    for subsection in subsections:
+        data[subsection] = pd.Series([
+            ' '.join([texts[(alto_dir, file, location)]
+                      for file, location in alto.parse_references(refs)])
+            if isinstance(refs, str) else refs
+            for alto_dir, refs in zip(data['alto_dir'], data[subsection])],
+            index=data.index, dtype=data[subsection].dtype)
+    return data
+
+
+def _references(data, subsections):
+    '''yields (alto_dir, list of (file, location)) for every reference in
+    the subsections of data
+    '''
+    for subsection in subsections:
+        for alto_dir, refs in zip(data['alto_dir'], data[subsection]):
+            if isinstance(refs, str):
+                yield alto_dir, alto.parse_references(refs)
+
+
+def _open_archive(path, archives):
+    '''returns the archive that path is in, or None if it is not in an
+    archive. The archives are opened once and kept in archives, by path
+    '''
+    split = archive.split_path(path)
+    if split is None:
+        return None
+    if split[0] not in archives:
+        archives[split[0]] = archive.Archive(split[0])
+    return archives[split[0]]
+
+
+def _columns(text_mode):
+    if text_mode not in TEXT_MODES:
+        raise ValueError('unknown text mode {}'.format(text_mode))
+    return reference_columns if text_mode == 'references' else columns
+
+
+def _cache_dir(cache_dir, text_mode):
+    '''issues parsed in the "references" mode are cached separately'''
+    if cache_dir and text_mode == 'references':
+        return os.path.join(cache_dir, 'references')
+    return cache_dir
+
+
+def _get_tasks(data_dir, alto_engine, text_mode='text', mets_engine='bs4',
+               source=None):
+    '''@param source: the opened archive, if data_dir is an archive'''
+    issues = source.find_issues() if source else find_issues(data_dir)
+    # issue ids are given in the order issues were found, also when the
+    # parsing fails
+    return [(mets_path, alto_dir, issue_id, alto_engine, text_mode,
+             mets_engine)
+            for issue_id, (mets_path, alto_dir)
+            in enumerate(issues, start=1)]
+
+
+def _parse_issues(tasks, workers=1, cache_dir=None, hash_files=False,
+                  read_ahead=0, read_ahead_bytes=cf.READ_AHEAD_BYTES,
+                  source=None):
+    '''yields the sections of every task, in the order of tasks. Yields None
+    for issues that could not be parsed
+
+    @param source: the opened archive the issues are in, if any
+    '''
+    signatures = {}
+    cached = set()
+    if cache_dir:
+        for mets_path, alto_dir, *_ in tasks:
+            if source:
+                signatures[mets_path] = source.signature(mets_path, alto_dir)
+            else:
+                signatures[mets_path] = cache.signature(mets_path, alto_dir,
+                                                        hash_files)
+            if cache.is_valid(cache_dir, mets_path, signatures[mets_path]):
+                cached.add(mets_path)
+        logger.info('%d of %d issues are cached', len(cached), len(tasks))
+    todo = [task for task in tasks if task[0] not in cached]
+
+    # the (task, files) of the issues to parse. The alto files are not
+    # needed in the references text mode
+    read_alto = any(task[4] == 'text' for task in todo)
+    if source:
+        reader = source.read_issues(todo, read_alto)
+    elif read_ahead and workers == 1:
+        reader = prefetch.read_ahead(todo, read_ahead, read_ahead_bytes,
+                                     alto=read_alto)
+    else:
+        reader = ((task, None) for task in todo)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if pool:
+            parsed = _map_in_order(pool, _issue_worker, reader, 2 * workers)
+        else:
+            parsed = (_get_issue_or_error(*task, files=files) + (None,)
+                      for task, files in reader)
+
+        for task in tasks:
+            mets_path, alto_dir, issue_id = task[:3]
+            if mets_path in cached:
+                result = cache.get(cache_dir, mets_path,
+                                   signatures[mets_path])
+                if result is not None:
+                    for section in result:
+                        section.issue.issue_id = issue_id
+                    metrics.count('issues_cached')
+                    yield result
+                    continue
 
             # getting data for single issue
-            logger.info('started file {}'.format(mets_file))
-            result = get_issue(mets_path, alto_dir, issue_id)
-            issue_id += 1
-            if result:  # get_issue will return None if problems
-                csv_file.writerows(result)
+            logger.info('started file %s', mets_path)
+            if mets_path in cached:
+                # the entry was removed or broken after it was checked
+                result, error, worker_data = _reparse(task, source)
+            else:
+                result, error, worker_data = next(parsed)
+            if worker_data:
+                metrics.merge(worker_data[0])
+                diagnostics.merge(worker_data[1])
+            metrics.count('issues')
+            if error:
+                metrics.count('issues_failed')
+                _report_error(mets_path, *error)
+            elif signatures.get(mets_path) is not None:
+                cache.put(cache_dir, mets_path, signatures[mets_path], result)
+            yield result
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        reader.close()
+
+
+def _reparse(task, source=None):
+    '''parses an issue that was expected in the cache, like the parsed
+    results of _parse_issues
+    '''
+    files = None
+    if source:
+        files = source.read_issue(task, task[4] == 'text')
+    return _get_issue_or_error(*task, files=files) + (None,)
+
+
+def _map_in_order(pool, func, tasks, window):
+    '''like pool.map, returns the results in the order of tasks, but only
+    submits up to window tasks more than the results that were consumed, so
+    that results do not pile up in memory when they are consumed slowly
+    '''
+    tasks = iter(tasks)
+    pending = collections.deque(pool.submit(func, task)
+                                for task in itertools.islice(tasks, window))
+    while pending:
+        result = pending.popleft().result()
+        for task in itertools.islice(tasks, 1):
+            pending.append(pool.submit(func, task))
+        yield result
 
 
 if __name__ == '__main__':
+    import bmt_parser.cli as cli
+    cli.configure_logging()
     main('../data/issues', '../output/data.csv')
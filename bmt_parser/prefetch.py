@@ -0,0 +1,108 @@
+'''
+Reads the files of the next issues in background threads while the current
+issue is parsed, so that parsing does not wait for the disk (slow or network
+storage). Use read_ahead().
+
+The files of an issue are the mets file and all the files in its alto dir.
+The alto pages an issue needs are only known after parsing its mets file, but
+the alto dir has just the pages of the issue.
+'''
+
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_ahead(issues, depth=2, max_bytes=128 * 2**20, threads=2,
+               alto=True):
+    '''yields (issue, files) for every issue in issues, in order. files is a
+    dict with the bytes of the mets file ("mets") and a dict {file name:
+    bytes} of the files in the alto dir ("alto"), or the OSError raised when
+    the files of the issue could not be read, so that the caller reports it
+    as the error of that issue.
+
+    Up to depth issues after the one that was yielded last are read in the
+    background, as long as the files of the issues that were submitted and
+    not yielded yet take at most max_bytes together (one issue is always
+    read, however large). The size of an issue is the size of its files when
+    they are listed, before they are read.
+
+    @param issues: (mets_path, alto_dir, ...) tuples, like parse_xml tasks
+    @param threads: number of threads reading files
+    @param alto: read the alto files. If False, "alto" is None
+    '''
+    issues = iter(issues)
+    pending = collections.deque()  # (issue, future, size)
+    upcoming = None  # (issue, files) of the next issue, not submitted yet
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        try:
+            while True:
+                # submitting issues until depth or max_bytes is reached. The
+                # size of an issue is reserved when it is submitted
+                held = sum(size for _, _, size in pending)
+                while len(pending) <= depth:
+                    if upcoming is None:
+                        issue = next(issues, None)
+                        if issue is None:
+                            break
+                        upcoming = issue, _files(issue, alto)
+                    issue, files = upcoming
+                    size = _size(files)
+                    if pending and held + size > max_bytes:
+                        break
+                    pending.append((issue, pool.submit(_read, issue, files,
+                                                        alto), size))
+                    held += size
+                    upcoming = None
+
+                if not pending:
+                    return
+                issue, future, _ = pending.popleft()
+                yield issue, future.result()
+        finally:
+            for _, future, _ in pending:
+                future.cancel()
+
+
+def _files(issue, alto):
+    '''returns a list of (path, size) of the files of an issue, or the
+    OSError raised when they could not be listed
+    '''
+    mets_path, alto_dir = issue[:2]
+    try:
+        files = [(mets_path, os.path.getsize(mets_path))]
+        if alto:
+            with os.scandir(alto_dir) as entries:
+                files.extend((entry.path, entry.stat().st_size)
+                             for entry in entries if entry.is_file())
+    except OSError as e:
+        return e
+    return files
+
+
+def _size(files):
+    if isinstance(files, OSError):
+        return 0
+    return sum(size for _, size in files)
+
+
+def _read(issue, files, alto):
+    '''returns the files of an issue as yielded by read_ahead. files is
+    returned by _files
+    '''
+    if isinstance(files, OSError):
+        return files
+    mets_path = issue[0]
+    result = {'mets': None, 'alto': {} if alto else None}
+    try:
+        for path, _ in files:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if path == mets_path:
+                result['mets'] = data
+            else:
+                result['alto'][os.path.basename(path)] = data
+    except OSError as e:
+        return e
+    return result
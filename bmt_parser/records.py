@@ -0,0 +1,116 @@
+'''
+The records of a parsed issue: the issue, its sections and the alto
+locations of their text. Issues have thousands of sections and locations, so
+the records are compact: slotted classes and tuples instead of dicts, and
+the sections of an issue share one Issue instead of repeating its date,
+volume and number.
+
+Values that repeat within and across issues (FILEIDs, subsection names, types
+of resource, authors) are interned with intern(), when the records are made
+and again when they are unpickled in another process, so that every value is
+kept once.
+'''
+
+import collections
+import sys
+
+
+# where the text of a subsection is: the FILEID of the alto file and the ID
+# of the TextBlock (BEGIN in the mets file)
+Location = collections.namedtuple('Location', ['file', 'loc'])
+
+
+def intern(value):
+    '''returns the interned value if it is a str, else the value'''
+    return sys.intern(value) if type(value) is str else value
+
+
+class _Record(object):
+    '''a record with slots. Records are equal if their slots are equal'''
+
+    __slots__ = ()
+    # slots whose values are interned when unpickled
+    _interned = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            self.__getstate__() == other.__getstate__()
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, value)
+            for name, value in self.__getstate__().items()))
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if name in self._interned:
+                value = intern(value)
+            setattr(self, name, value)
+
+
+class Issue(_Record):
+    '''issue level data, shared by the sections of the issue'''
+
+    __slots__ = ('issue_id', 'date', 'volume', 'number', 'alto_dir',
+                 'sections')
+
+    def __init__(self, date, volume, number, sections=None):
+        self.issue_id = None
+        self.date = date
+        self.volume = volume
+        self.number = number
+        self.alto_dir = None
+        self.sections = [] if sections is None else sections
+
+
+class Section(_Record):
+    '''a section (text, image...) of an issue.
+
+    subsections is a dict {subsection name: list of Locations, or None if the
+    section does not have the subsection}, from the mets file. texts is a
+    dict {subsection name: text} of the subsections that have locations,
+    from the alto files. Slots that are not set, like section_type, and
+    values that are None are missing values.
+    '''
+
+    __slots__ = ('issue', 'section_id', 'title', 'authors', 'section_type',
+                 'type_of_resource', 'subsections', 'texts')
+    _interned = ('authors', 'type_of_resource')
+
+    def __init__(self, section_id, title, authors, type_of_resource,
+                 subsections=None):
+        self.issue = None
+        self.section_id = section_id
+        self.title = title
+        self.authors = intern(authors)
+        self.type_of_resource = intern(type_of_resource)
+        self.subsections = {} if subsections is None else subsections
+        self.texts = {}
+
+    def get(self, column, default=''):
+        '''returns the value of a column of the parsed data (see
+        parse_xml.columns), or default if the section does not have it or
+        the value is None (like authors of a section without names)
+        '''
+        if column in _ISSUE_COLUMNS:
+            value = getattr(self.issue, column, None)
+        elif column in self.texts:
+            value = self.texts[column]
+        elif column in _SECTION_COLUMNS:
+            value = getattr(self, column, None)
+        else:
+            value = None
+        return default if value is None else value
+
+    def row(self, columns):
+        '''returns the values of columns as a tuple'''
+        return tuple(self.get(column) for column in columns)
+
+
+_ISSUE_COLUMNS = {'issue_id', 'date', 'volume', 'number', 'alto_dir'}
+_SECTION_COLUMNS = {'section_id', 'title', 'authors', 'section_type',
+                    'type_of_resource'}
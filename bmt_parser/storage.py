@@ -0,0 +1,142 @@
+'''
+Reading and writing the tables in config.PATHS (parsed data, disambiguated
+data, collaborators).
+
+Formats:
+
+ - csv: tab separated text (config.CSV_SEP), the default
+ - parquet, feather: columnar formats with typed columns (see
+   config.COLUMN_TYPES). Reading only some columns does not parse the rest
+   of the file. These need the pyarrow library.
+
+Empty strings are stored as missing values in the columnar formats, so that
+the data reads back the same as from csv.
+'''
+
+import csv
+import os
+import bmt_parser.config as cf
+
+
+FORMATS = cf.DATA_FORMATS
+
+
+def output_path(path, fmt):
+    '''returns path with the extension of the format'''
+    return os.path.splitext(path)[0] + '.' + fmt
+
+
+def read(path, fmt='csv', columns=None):
+    '''reads a table. If columns is given, only those columns are loaded'''
+    import pandas as pd
+    if fmt == 'csv':
+        return pd.read_csv(path, sep=cf.CSV_SEP, usecols=columns)
+    elif fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    elif fmt == 'feather':
+        return pd.read_feather(path, columns=columns)
+    raise ValueError('unknown data format {}'.format(fmt))
+
+
+def write(data, path, fmt='csv'):
+    '''writes a DataFrame'''
+    if fmt == 'csv':
+        data.to_csv(path, sep=cf.CSV_SEP, index=False)
+        return
+
+    data = data.reset_index(drop=True)
+    for column, dtype in cf.COLUMN_TYPES.items():
+        if column in data.columns:
+            if dtype == 'string':
+                data[column] = data[column].mask(data[column] == '')
+            data[column] = data[column].astype(dtype)
+
+    if fmt == 'parquet':
+        data.to_parquet(path, index=False)
+    elif fmt == 'feather':
+        data.to_feather(path)
+    else:
+        raise ValueError('unknown data format {}'.format(fmt))
+
+
+def write_rows(data, path, fmt='csv', batch_size=10000):
+    '''writes a DataFrame with a TableWriter, so that the file is the same as
+    when its rows are written while parsing. Missing values are written as
+    empty strings
+    '''
+    with TableWriter(path, list(data.columns), fmt, batch_size) as writer:
+        for start in range(0, len(data), batch_size):
+            batch = data.iloc[start:start + batch_size].astype(object)
+            writer.write_rows(batch.where(batch.notna(), '')
+                              .to_dict('records'))
+
+
+class TableWriter(object):
+    '''writes rows (dicts) to a table batch by batch, so that the whole table
+    does not need to be in memory. Use as a context manager:
+
+        with TableWriter(path, columns, 'parquet') as writer:
+            writer.write_rows(rows)
+    '''
+
+    def __init__(self, path, columns, fmt='csv', batch_size=10000):
+        if fmt not in FORMATS:
+            raise ValueError('unknown data format {}'.format(fmt))
+        self.path = path
+        self.columns = columns
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self._batch = []
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        if self.fmt == 'csv':
+            self._file = open(self.path, 'w')
+            self._writer = csv.DictWriter(self._file, self.columns,
+                                          delimiter=cf.CSV_SEP)
+            self._writer.writeheader()
+        else:
+            import pyarrow as pa
+            self._schema = pa.schema([
+                (column, _arrow_type(cf.COLUMN_TYPES.get(column, 'string')))
+                for column in self.columns])
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(self.path, self._schema)
+        return self
+
+    def write_rows(self, rows):
+        if self.fmt == 'csv':
+            self._writer.writerows(rows)
+            return
+        self._batch.extend(rows)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        arrays = {column: [_null_if_empty(row.get(column))
+                           for row in self._batch]
+                  for column in self.columns}
+        self._writer.write_table(pa.Table.from_pydict(arrays, self._schema))
+        self._batch = []
+
+    def __exit__(self, *exc):
+        if self.fmt == 'csv':
+            self._file.close()
+            return
+        if self._batch:
+            self._flush()
+        self._writer.close()
+
+
+def _arrow_type(dtype):
+    import pyarrow as pa
+    return {'int64': pa.int64(), 'string': pa.string()}[dtype]
+
+
+def _null_if_empty(value):
+    return None if value == '' else value
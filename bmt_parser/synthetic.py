@@ -0,0 +1,259 @@
+'''
+Generates synthetic Blue Mountain-shaped data: issue directories that contain
+a mets file and an alto dir with one file per page, plus a matching
+disambiguation file. Used for tests and benchmarks.
+
+The generated data only has the parts of the mets and alto schemas that the
+parser reads.
+'''
+
+import os
+import random
+from xml.sax.saxutils import quoteattr, escape
+
+
+METS_NS = ('xmlns:mets="http://www.loc.gov/METS/" '
+           'xmlns:mods="http://www.loc.gov/mods/v3" '
+           'xmlns:xlink="http://www.w3.org/1999/xlink"')
+ALTO_NS = 'xmlns="http://www.loc.gov/standards/alto/ns-v2#"'
+
+FIRST_NAMES = ['Herwarth', 'Else', 'August', 'Franz', 'Lothar', 'Nell',
+               'Rudolf', 'Paul', 'Kurt', 'Wassily', 'Oskar', 'Mynona',
+               'Alfred', 'Peter', 'Jacoba', 'Sophie', 'Gösta', 'Hilla']
+SURNAMES = ['Walden', 'Lasker-Schüler', 'Stramm', 'Marc', 'Schreyer',
+            'Blümner', 'Scheerbart', 'Schwitters', 'Kandinsky', 'Kokoschka',
+            'Döblin', 'Baum', 'Heemskerck', 'Taeuber', 'Adrian-Nilsson',
+            'Rebay', 'Friedlaender', 'Behrens']
+WORDS = ['der', 'die', 'das', 'Sturm', 'Kunst', 'Wochenschrift', 'für',
+         'Kultur', 'und', 'Künste', 'Gedicht', 'Bild', 'Zeit', 'Stadt',
+         'Nacht', 'Ausstellung', 'Verlag', 'Berlin', 'Holzschnitt', 'Musik']
+
+
+def generate(output_dir, issues=10, sections=10, pages=8, blocks=20,
+             words=30, hyphenation=0.1, authors=200, missing=0.1, seed=0,
+             periodical='bmtnsyn'):
+    '''writes a synthetic periodical into output_dir
+
+    @param issues: number of issues
+    @param sections: text sections per issue. Every tenth is an image, every
+      seventh an advertisement and every fifth a parent with two subsections
+    @param pages: alto pages per issue
+    @param blocks: TextBlocks per page
+    @param words: words (String elements) per TextBlock
+    @param hyphenation: probability that a word is hyphenated across lines
+    @param authors: size of the author pool
+    @param missing: share of the authors that are not in the disambiguation
+      file
+    @returns: dict with the paths of the issues dir and of the
+      disambiguation file
+    '''
+    rnd = random.Random(seed)
+    names = _author_pool(rnd, authors)
+    issues_dir = os.path.join(output_dir, periodical, 'issues')
+
+    for number in range(1, issues + 1):
+        year = 1910 + (number - 1) // 52
+        date = '{}-{:02d}-{:02d}'.format(year, (number - 1) % 12 + 1,
+                                         (number - 1) % 28 + 1)
+        issue_name = '{}_{}_{:02d}'.format(periodical, date[:7],
+                                           (number - 1) % 28 + 1)
+        issue_dir = os.path.join(issues_dir, str(year),
+                                 '{:05d}'.format(number))
+        alto_dir = os.path.join(issue_dir, 'alto')
+        os.makedirs(alto_dir, exist_ok=True)
+
+        # distributing the TextBlocks of all pages over the sections
+        locations = [('alto{:05d}'.format(page),
+                      'P{}_TB{:05d}'.format(page, block))
+                     for page in range(1, pages + 1)
+                     for block in range(1, blocks + 1)]
+        per_section = max(1, len(locations) // max(1, sections))
+        mets_sections = []
+        for idx in range(sections):
+            locs = locations[idx * per_section:(idx + 1) * per_section]
+            mets_sections.append(_section(rnd, idx + 1, locs, names))
+
+        with open(os.path.join(issue_dir, issue_name + '.mets.xml'), 'w',
+                  encoding='utf-8') as f:
+            f.write(_mets(issue_name, number, date, pages, mets_sections))
+
+        for page in range(1, pages + 1):
+            path = os.path.join(alto_dir, '{}_{:04d}.alto.xml'.format(
+                issue_name, page))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(_alto(rnd, page, blocks, words, hyphenation))
+
+    disamb_path = os.path.join(output_dir, periodical + '_disambiguation.csv')
+    with open(disamb_path, 'w', encoding='utf-8') as f:
+        f.write('Unique Names\tNameCopy\n')
+        for name in names:
+            if rnd.random() < missing:
+                continue
+            # every third name has a resolved form in "surname, name" order
+            if rnd.random() < 0.33:
+                first, _, last = name.partition(' ')
+                f.write('{}\t{}, {}\n'.format(name, last, first))
+            else:
+                f.write('{}\t\n'.format(name))
+
+    return {'issues': issues_dir, 'disambiguation': disamb_path}
+
+
+def _author_pool(rnd, size):
+    names = set()
+    while len(names) < size:
+        name = '{} {}'.format(rnd.choice(FIRST_NAMES), rnd.choice(SURNAMES))
+        if len(names) > len(FIRST_NAMES) * len(SURNAMES) // 2:
+            name = '{} {}'.format(name, len(names))
+        names.add(name)
+    return sorted(names)
+
+
+def _section(rnd, idx, locations, names):
+    section = {'id': 'c{:03d}'.format(idx),
+               'title': ' '.join(rnd.sample(WORDS, 2)).capitalize(),
+               'authors': rnd.sample(names, rnd.choice([0, 1, 1, 1, 2])),
+               'children': []}
+    if idx % 10 == 0:
+        section['kind'] = 'image'
+        locations = []
+    elif idx % 7 == 0:
+        section['kind'] = 'advertisement'
+    else:
+        section['kind'] = 'text'
+
+    if section['kind'] == 'text' and idx % 5 == 0 and len(locations) >= 5:
+        # a parent has its own heading, the rest is split between two
+        # subsections that take the authors of the parent
+        section['divs'] = {'Head': locations[:1]}
+        rest = locations[1:]
+        half = len(rest) // 2
+        for c, locs in enumerate([rest[:half], rest[half:]]):
+            child = {'id': '{}_{:02d}'.format(section['id'], c + 1),
+                     'title': rnd.choice(WORDS).capitalize(),
+                     'authors': [], 'children': [], 'kind': 'text',
+                     'divs': _divs(locs)}
+            section['children'].append(child)
+    else:
+        section['divs'] = _divs(locations)
+    return section
+
+
+def _divs(locations):
+    '''splits alto locations into Head, Byline and Copy divs'''
+    if not locations:
+        return {}
+    if len(locations) < 3:
+        return {'Copy': locations}
+    return {'Head': locations[:1], 'Byline': locations[1:2],
+            'Copy': locations[2:]}
+
+
+def _mods_section(section):
+    resource = 'still image' if section['kind'] == 'image' else 'text'
+    genre = {'image': 'Illustration', 'advertisement': 'Advertisement',
+             'text': 'TextContent'}[section['kind']]
+    parts = ['<mods:relatedItem type="constituent" ID="{}">'.format(
+        section['id'])]
+    parts.append('<mods:titleInfo><mods:title>{}</mods:title>'
+                 '</mods:titleInfo>'.format(escape(section['title'])))
+    for name in section['authors']:
+        parts.append('<mods:name type="personal"><mods:displayForm>{}'
+                     '</mods:displayForm><mods:role><mods:roleTerm '
+                     'type="code">cre</mods:roleTerm></mods:role>'
+                     '</mods:name>'.format(escape(name)))
+    parts.append('<mods:typeOfResource>{}</mods:typeOfResource>'.format(
+        resource))
+    parts.append('<mods:genre>{}</mods:genre>'.format(genre))
+    parts.extend(_mods_section(child) for child in section['children'])
+    parts.append('</mods:relatedItem>')
+    return '\n'.join(parts)
+
+
+def _struct_divs(section):
+    parts = []
+    if section['kind'] == 'image':
+        parts.append('<mets:div TYPE="Illustration" DMDID="{}"/>'.format(
+            section['id']))
+    else:
+        div_type = ('SponsoredAd' if section['kind'] == 'advertisement'
+                    else 'TextContent')
+        parts.append('<mets:div TYPE="{}" DMDID="{}">'.format(
+            div_type, section['id']))
+        for name, locations in section['divs'].items():
+            parts.append('<mets:div TYPE="{}">'.format(name))
+            for fileid, begin in locations:
+                parts.append('<mets:fptr><mets:area BETYPE="IDREF" '
+                             'FILEID="{}" BEGIN="{}"/></mets:fptr>'.format(
+                                 fileid, begin))
+            parts.append('</mets:div>')
+        parts.append('</mets:div>')
+    for child in section['children']:
+        parts.extend(_struct_divs(child))
+    return parts
+
+
+def _mets(issue_name, number, date, pages, sections):
+    files = '\n'.join(
+        '<mets:file ID="alto{0:05d}" MIMETYPE="text/xml"><mets:FLocat '
+        'LOCTYPE="URL" xlink:href="file:alto/{1}_{0:04d}.alto.xml"/>'
+        '</mets:file>'.format(page, issue_name)
+        for page in range(1, pages + 1))
+    struct = '\n'.join(div for section in sections
+                       for div in _struct_divs(section))
+    return '''<?xml version="1.0" encoding="UTF-8"?>
+<mets:mets {ns} OBJID="{issue_name}">
+<mets:dmdSec ID="bmtn_issue">
+<mets:mdWrap MDTYPE="MODS"><mets:xmlData>
+<mods:mods>
+<mods:titleInfo><mods:title>Synthetic periodical</mods:title></mods:titleInfo>
+<mods:part type="issue">
+<mods:detail type="volume"><mods:number>{volume}</mods:number></mods:detail>
+<mods:detail type="number"><mods:number>{number}</mods:number></mods:detail>
+</mods:part>
+<mods:originInfo><mods:dateIssued keyDate="yes">{date}</mods:dateIssued>
+</mods:originInfo>
+{sections}
+</mods:mods>
+</mets:xmlData></mets:mdWrap>
+</mets:dmdSec>
+<mets:fileSec><mets:fileGrp USE="Text">
+{files}
+</mets:fileGrp></mets:fileSec>
+<mets:structMap TYPE="LOGICAL" LABEL="Logical Structure">
+<mets:div TYPE="Magazine" DMDID="bmtn_issue">
+{struct}
+</mets:div>
+</mets:structMap>
+</mets:mets>
+'''.format(ns=METS_NS, issue_name=issue_name, date=date,
+           volume=(number - 1) // 52 + 1, number=number,
+           sections='\n'.join(_mods_section(s) for s in sections),
+           files=files, struct=struct)
+
+
+def _alto(rnd, page, blocks, words, hyphenation):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<alto {}><Layout><Page ID="P{}"><PrintSpace>'.format(
+                 ALTO_NS, page)]
+    for block in range(1, blocks + 1):
+        parts.append('<TextBlock ID="P{}_TB{:05d}">'.format(page, block))
+        line = []
+        for w in range(words):
+            word = rnd.choice(WORDS)
+            if rnd.random() < hyphenation and len(word) > 3:
+                cut = len(word) // 2
+                line.append('<String CONTENT={} SUBS_TYPE="HypPart1" '
+                            'SUBS_CONTENT={}/><HYP CONTENT="-"/>'.format(
+                                quoteattr(word[:cut]), quoteattr(word)))
+                parts.append('<TextLine>{}</TextLine>'.format(''.join(line)))
+                line = ['<String CONTENT={} SUBS_TYPE="HypPart2" '
+                        'SUBS_CONTENT={}/>'.format(quoteattr(word[cut:]),
+                                                   quoteattr(word))]
+            else:
+                line.append('<String CONTENT={}/>'.format(quoteattr(word)))
+            line.append('<SP/>')
+        parts.append('<TextLine>{}</TextLine>'.format(''.join(line)))
+        parts.append('</TextBlock>')
+    parts.append('</PrintSpace></Page></Layout></alto>')
+    return '\n'.join(parts)
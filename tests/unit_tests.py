@@ -1,6 +1,31 @@
 import unittest
+import contextlib
+import io
+import logging
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import bmt_parser.archive as archive
 import bmt_parser.collaborators as collabs
 import bmt_parser.name_corrections as corr
+import bmt_parser.name_matching as matching
+import bmt_parser.parse_alto as alto
+import bmt_parser.parse_mets as mets
+import bmt_parser.cache as cache
+import bmt_parser.disambiguate_names as disamb
+import bmt_parser.storage as storage
+import bmt_parser.parse_xml as parse_xml
+import bmt_parser.synthetic as synthetic
+import bmt_parser.metrics as metrics
+import bmt_parser.prefetch as prefetch
+import bmt_parser.diagnostics as diagnostics
+import bmt_parser.cli as cli
+import bmt_parser.config as cf
+import bmt_parser.records as records
+from bmt_parser.MyError import MyError
 import pandas as pd
 
 
@@ -40,6 +65,35 @@ class Test_collabs(unittest.TestCase):
         self.assertTrue(['a', 'c', 1] in as_list)
         self.assertTrue(['b', 'c', 1] in as_list)
 
+    def test_no_authors(self):
+        testdata = pd.DataFrame({'issue_id': [1, 1, 2],
+                                 'authors': [None, 'a', 'a||a']})
+        result = collabs.get_collaborators(testdata)
+        self.assertEqual(len(result), 0)
+        self.assertEqual(list(result.columns), ['author1', 'author2', 'count'])
+
+    def test_matrix(self):
+        testdata = pd.DataFrame({'issue_id': [1, 1, 1, 2, 2],
+                                 'authors': ['a', 'b', 'c||d', 'a', 'b']})
+        matrix = collabs.get_collaboration_matrix(testdata)
+        names, indptr, indices, counts = matrix
+        self.assertEqual(list(names), ['a', 'b', 'c', 'd'])
+        self.assertEqual(list(indptr), [0, 3, 6, 9, 12])
+        # collaborators of "a"
+        self.assertEqual(list(indices[0:3]), [1, 2, 3])
+        self.assertEqual(list(counts[0:3]), [2, 1, 1])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'collabs.npz')
+            collabs.save_collaboration_matrix(
+                matrix, path, os.path.join(tmp, 'authors.csv'))
+            for mmap_mode in [None, 'r']:
+                loaded = collabs.load_collaboration_matrix(path, mmap_mode)
+                self.assertEqual(list(loaded['shape']), [4, 4])
+                self.assertEqual(list(loaded['data']), list(counts))
+                self.assertEqual(list(loaded['indices']), list(indices))
+                del loaded
+
 
 class Test_corrections(unittest.TestCase):
 
@@ -198,3 +252,873 @@ class Test_corrections(unittest.TestCase):
         self.assertEqual(corr.capitalize("R. Reiche"), "R. Reiche")
         # this one is very unusual
         self.assertEqual(corr.capitalize("C. O. —E"), "C. O. —e")
+
+    def test_normalizer(self):
+        normalizer = corr.NameNormalizer(maxsize=2)
+        self.assertEqual(normalizer.capitalize("VERA IDELSON"),
+                         "Vera Idelson")
+        self.assertEqual(normalizer.capitalize("VERA IDELSON"),
+                         "Vera Idelson")
+        self.assertEqual(normalizer.get_title_and_rest('Prof. Kochalka'),
+                         corr.get_title_and_rest('Prof. Kochalka'))
+        self.assertEqual(normalizer.hits, 1)
+        self.assertEqual(normalizer.misses, 2)
+        self.assertEqual(normalizer.stats()['capitalize'], (1, 1))
+
+
+ALTO_PAGE = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v2#">
+<Layout><Page ID="P1"><PrintSpace>
+<TextBlock ID="P1_TB00001">
+  <TextLine><String CONTENT="Der" /><SP /><String CONTENT="Sturm" /></TextLine>
+</TextBlock>
+<ComposedBlock ID="P1_CB00001">
+<TextBlock ID="P1_TB00002">
+  <TextLine><String CONTENT="Wochen-" SUBS_TYPE="HypPart1"
+    SUBS_CONTENT="Wochenschrift" /></TextLine>
+  <TextLine><String CONTENT="schrift" SUBS_TYPE="HypPart2"
+    SUBS_CONTENT="Wochenschrift" /><String CONTENT="für&#9;Kultur" />
+  </TextLine>
+</TextBlock>
+</ComposedBlock>
+<TextBlock ID="P1_TB00003">
+  <TextLine><String CONTENT="Herwarth" /><String CONTENT="Walden" /></TextLine>
+</TextBlock>
+</PrintSpace></Page></Layout>
+</alto>
+'''
+
+
+class Test_name_matching(unittest.TestCase):
+
+    def test_match(self):
+        index = matching.NgramIndex(['Herwarth Walden', 'August Stramm',
+                                     'Paul Klee', 'Paul Klee'])
+        positions, scores = index.match(
+            ['HERWARTH WALCLEN', 'Augusr Stramm', 'Paul Klee', 'Lothar '
+             'Schreyer', ''], threshold=0.6)
+        # of equal names, the first one is returned
+        self.assertEqual(list(positions), [0, 1, 2, -1, -1])
+        self.assertEqual(scores[2], 1.0)
+        self.assertEqual(scores[3], 0.0)
+        # batches give the same result
+        self.assertEqual(
+            list(index.match(['Augusr Stramm', 'Paul Klee'], 0.6,
+                             max_pairs=1)[0]), [1, 2])
+        # n-grams of too many names are not used to find candidates
+        index = matching.NgramIndex(['Paul Klee', 'Paul Klee'],
+                                    max_postings=1)
+        self.assertEqual(list(index.match(['Paul Klee'], 0.6)[0]), [-1])
+
+    def test_same_as_all_pairs(self):
+        # the filters of the index do not change the result
+        names = ['{} {}'.format(first, last)
+                 for first in ['Paul', 'Pauline', 'Hans', 'Anna', 'H.']
+                 for last in ['Klee', 'Kleen', 'Arp', 'Harp', 'Walden']]
+        queries = names[::3] + ['Paula Kle', 'Hans Warden', 'Ann', 'Xaver']
+        index = matching.NgramIndex(names)
+        grams = [matching.ngrams(name) for name in names]
+        for threshold in [0.0, 0.4, 0.75, 1.0]:
+            positions, scores = index.match(queries, threshold,
+                                            max_pairs=20)
+            for query, position, score in zip(queries, positions, scores):
+                query_grams = matching.ngrams(query)
+                dice = [2 * len(query_grams & name_grams) /
+                        (len(query_grams) + len(name_grams))
+                        for name_grams in grams]
+                best = max(range(len(names)), key=lambda i: (dice[i], -i))
+                if dice[best] >= threshold and dice[best] > 0:
+                    self.assertEqual((position, score), (best, dice[best]))
+                else:
+                    self.assertEqual(position, -1)
+
+    def test_size_bounds(self):
+        self.assertEqual(matching.size_bounds(12, 0.75), (8, 20))
+        self.assertEqual(matching.min_shared(12, 0.75), 8)
+        self.assertEqual(matching.min_shared(12, 0.0), 1)
+
+    def test_ngrams(self):
+        self.assertEqual(matching.ngrams('Klee,  P.'),
+                         {' kl', 'kle', 'lee', 'ee ', 'e p', ' p '})
+
+
+class Test_disambiguation(unittest.TestCase):
+
+    def test_disambiguate_names(self):
+        data = pd.DataFrame({'authors': ['VERA IDELSON||Paul Nouge',
+                                         ' Herwarth Walden', None,
+                                         'Unknown||Vera Idelson']})
+        table = pd.DataFrame({
+            'found': ['Vera Idelson', 'Paul Nouge', 'Herwarth Walden'],
+            'resolved': ['Idelson, Vera', 'Paul Nougé', 'Walden, Herwarth']})
+
+        diagnostics.reset()
+        result = disamb.disambiguate_names(data, table)
+        self.assertEqual(result.authors[0], 'Idelson, Vera||Paul Nougé')
+        self.assertEqual(result.authors[1], 'Walden, Herwarth')
+        self.assertTrue(pd.isnull(result.authors[2]))
+        # rows with an unknown name are not changed
+        self.assertEqual(result.authors[3], 'Unknown||Vera Idelson')
+        self.assertEqual(
+            diagnostics.report()['author_without_disambiguation']['records'],
+            [['author "Unknown" does not have a disambiguation', 1]])
+
+    def test_runs_start_cold(self):
+        # every run normalizes its names again, as if it was the first run
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = synthetic.generate(tmp, issues=2, sections=5, pages=1,
+                                       blocks=5, authors=10)
+            data = parse_xml.get_data(paths['issues'])
+            counts = []
+            for _ in range(2):
+                metrics.reset()
+                disamb.disambiguate_data(data.copy(), paths['disambiguation'])
+                counts.append(metrics.report()['counts']['name_cache_misses'])
+        self.assertGreater(counts[0], 0)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_match_missing_names(self):
+        table = pd.DataFrame({
+            'found': ['Herwarth Walden', 'H. Walden', 'August Stramm'],
+            'resolved': ['Walden, Herwarth', 'Walden, Herwarth',
+                         'Stramm, August']})
+        table = disamb.add_missing_names(
+            table, {'Herwarth Walden', 'Herwarth Walclen', 'Paul Klee'})
+        table = disamb.match_missing_names(table, 0.75)
+        proposals = table.set_index('found')
+        self.assertEqual(proposals.loc['Herwarth Walclen',
+                                       'resolved_proposal'],
+                         'Walden, Herwarth')
+        self.assertGreaterEqual(proposals.loc['Herwarth Walclen',
+                                              'proposal_score'], 0.75)
+        # no similar name, and names from the file do not get proposals
+        self.assertTrue(pd.isnull(proposals.loc['Paul Klee',
+                                                'resolved_proposal']))
+        self.assertTrue(pd.isnull(proposals.loc['August Stramm',
+                                                'proposal_score']))
+
+    def test_matching_is_opt_in(self):
+        names = {'Herwarth Walden', 'Herwarth Walclen'}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'disambiguation.csv')
+            pd.DataFrame({'Unique Names': ['Herwarth Walden'],
+                          'NameCopy': ['Walden, Herwarth']}).to_csv(
+                path, sep=cf.CSV_SEP, index=False)
+            default = disamb.prepare_disambiguation_file(path, names)
+            applied = disamb.prepare_disambiguation_file(
+                path, names, apply_matches=True)
+        self.assertNotIn('resolved_proposal', default.columns)
+        resolved = applied.set_index('found')['resolved']
+        self.assertEqual(resolved['Herwarth Walclen'],
+                         resolved['Herwarth Walden'])
+
+        parser = cli.get_parser()
+        args = parser.parse_args(['disambiguate', '-d', 'd.csv'])
+        self.assertIsNone(args.match_threshold)
+        args = parser.parse_args(['disambiguate', '-d', 'd.csv',
+                                  '--match_threshold'])
+        self.assertEqual(args.match_threshold, cf.NAME_MATCH_THRESHOLD)
+
+    def test_fix_repeated_resolved(self):
+        table = pd.DataFrame({
+            'found': ['A', 'B', 'C', 'X', 'Y', 'Z', 'A'],
+            'resolved': ['B', 'C', 'D', 'Y', 'Z', 'X', 'E']})
+        diagnostics.reset()
+        result = disamb.fix_repeated_resolved(table)
+        # chains are followed to their end
+        self.assertEqual(list(result['resolved'][:3]), ['D', 'D', 'D'])
+        # the cycle resolves to the name where it was closed
+        self.assertEqual(list(result['resolved'][3:6]), ['Z', 'Z', 'Z'])
+        self.assertEqual(diagnostics.report()['resolution_cycle']['records'],
+                         [['resolutions form a cycle: Z -> X -> Y -> Z', 1]])
+        # the first resolution of a repeated found name is followed
+        self.assertEqual(result['resolved'][6], 'E')
+        self.assertEqual(diagnostics.count('repeated_found_name'), 1)
+
+    def test_resolve_initials(self):
+        table = disamb.fix_names(pd.DataFrame({
+            'found': ['Herwarth Walden', 'H. W.', 'Dr. A. D.',
+                      'Alfred Döblin', 'Dr. Alfred Dreyfus', 'A. D.', 'X. Y.',
+                      'N. W.'],
+            'resolved': ['Walden, Herwarth', 'H. W.', 'Dr. A. D.',
+                         'Döblin, Alfred', 'Dreyfus, Alfred', 'A. D.',
+                         'X. Y.', 'Walden, Nell']}))
+        diagnostics.reset()
+        result = disamb.resolve_initials(table.copy()).set_index('found')
+        self.assertEqual(result.loc['H. W.', 'resolved'], 'H. W.')
+        self.assertEqual(diagnostics.count('initials_replacement'), 2)
+
+        result = disamb.resolve_initials(table.copy(), apply=True)
+        result = result.set_index('found')['resolved']
+        self.assertEqual(result['H. W.'], 'Herwarth Walden')
+        # the title selects one of the candidates
+        self.assertEqual(result['Dr. A. D.'], 'Alfred Dreyfus')
+        # ambiguous, without candidates, or resolved by the file
+        self.assertEqual(result['A. D.'], 'A. D.')
+        self.assertEqual(result['X. Y.'], 'X. Y.')
+        self.assertEqual(result['N. W.'], 'Nell Walden')
+        self.assertEqual(diagnostics.count('initials_ambiguous'), 2)
+
+    def test_fix_names(self):
+        table = pd.DataFrame({
+            'found': [' Dr. A. B.', 'VERA IDELSON', 'Dr. A. B.'],
+            'resolved': ['Braun, Anton', 'Idelson, Vera (1893-1954)',
+                         'Braun, Anton']})
+        table = disamb.fix_names(table)
+        self.assertEqual(list(table['found']),
+                         ['Dr. A. B.', 'Vera Idelson', 'Dr. A. B.'])
+        self.assertEqual(list(table['resolved']),
+                         ['Anton Braun', 'Vera Idelson', 'Anton Braun'])
+        self.assertEqual(list(table['titles']), ['Dr.', '', 'Dr.'])
+        self.assertEqual(list(table['initials_found']),
+                         ['A. B.', 'V. I.', 'A. B.'])
+        self.assertEqual(list(table['initials_resolved']),
+                         ['A. B.', 'V. I.', 'A. B.'])
+        self.assertEqual(list(table['found_are_initials']),
+                         [True, False, True])
+        self.assertEqual(list(table['surname_found']),
+                         ['B.', 'Idelson', 'B.'])
+
+
+METS_ISSUE = '''<?xml version="1.0" encoding="UTF-8"?>
+<mets:mets xmlns:mets="http://www.loc.gov/METS/"
+ xmlns:mods="http://www.loc.gov/mods/v3">
+<mets:dmdSec ID="bmtn_issue"><mets:mdWrap MDTYPE="MODS"><mets:xmlData>
+<mods:mods>
+<mods:titleInfo><mods:title>Der Sturm</mods:title></mods:titleInfo>
+<mods:part type="issue">
+<mods:detail type="volume"><mods:number>1</mods:number></mods:detail>
+<mods:detail type="number"><mods:number>3</mods:number></mods:detail>
+</mods:part>
+<mods:originInfo>
+<mods:dateIssued keyDate="yes">1910-03-17</mods:dateIssued>
+</mods:originInfo>
+<mods:relatedItem type="host" ID="h001"/>
+<mods:relatedItem type="constituent" ID="c001">
+<mods:titleInfo><mods:nonSort>Der</mods:nonSort><mods:title>Sturm</mods:title>
+<mods:subTitle>Gedicht</mods:subTitle></mods:titleInfo>
+<mods:name type="personal"><mods:displayForm>HERWARTH WALDEN</mods:displayForm>
+<mods:role><mods:roleTerm type="code">cre</mods:roleTerm></mods:role>
+</mods:name>
+<mods:name type="personal"><mods:displayForm>Nell Walden</mods:displayForm>
+<mods:role><mods:roleTerm type="code">edt</mods:roleTerm></mods:role>
+</mods:name>
+<mods:typeOfResource>text</mods:typeOfResource>
+<mods:genre>TextContent</mods:genre>
+</mods:relatedItem>
+<mods:relatedItem type="constituent" ID="c002">
+<mods:titleInfo><mods:title>Kunst</mods:title></mods:titleInfo>
+<mods:name type="personal"><mods:displayForm>August Stramm</mods:displayForm>
+<mods:role><mods:roleTerm type="code">cre</mods:roleTerm></mods:role>
+</mods:name>
+<mods:typeOfResource>text</mods:typeOfResource>
+<mods:genre>TextContent</mods:genre>
+<mods:relatedItem type="constituent" ID="c003">
+<mods:titleInfo><mods:title>Nacht</mods:title></mods:titleInfo>
+<mods:typeOfResource>text</mods:typeOfResource>
+<mods:genre>TextContent</mods:genre>
+</mods:relatedItem>
+<mods:relatedItem ID="c004">
+<mods:titleInfo><mods:title>Zeit</mods:title></mods:titleInfo>
+<mods:typeOfResource>text</mods:typeOfResource>
+<mods:genre>TextContent</mods:genre>
+</mods:relatedItem>
+</mods:relatedItem>
+<mods:relatedItem type="constituent" ID="c005">
+<mods:titleInfo><mods:title>Holzschnitt</mods:title></mods:titleInfo>
+<mods:typeOfResource>still image</mods:typeOfResource>
+<mods:genre>Illustration</mods:genre>
+</mods:relatedItem>
+<mods:relatedItem type="constituent" ID="c006">
+<mods:titleInfo><mods:title>Verlag</mods:title></mods:titleInfo>
+<mods:typeOfResource>text</mods:typeOfResource>
+<mods:genre>Advertisement</mods:genre>
+</mods:relatedItem>
+<mods:relatedItem type="constituent" ID="c007">
+<mods:titleInfo><mods:title>Inhalt</mods:title></mods:titleInfo>
+<mods:typeOfResource>text</mods:typeOfResource>
+<mods:genre>TextContent</mods:genre>
+</mods:relatedItem>
+<mods:relatedItem type="constituent" ID="c008">
+<mods:titleInfo><mods:title>Musik</mods:title></mods:titleInfo>
+<mods:typeOfResource>notated music</mods:typeOfResource>
+<mods:genre>Music</mods:genre>
+</mods:relatedItem>
+</mods:mods>
+</mets:xmlData></mets:mdWrap></mets:dmdSec>
+<mets:structMap TYPE="LOGICAL" LABEL="Logical Structure">
+<mets:div TYPE="Magazine" DMDID="bmtn_issue">
+<mets:div TYPE="TextContent" DMDID="c001">
+<mets:div TYPE="Head"><mets:fptr>
+<mets:area FILEID="alto00001" BEGIN="P1_TB00001"/></mets:fptr></mets:div>
+<mets:div TYPE="Byline          "><mets:fptr>
+<mets:area FILEID="alto00001" BEGIN="P1_TB00002"/></mets:fptr></mets:div>
+<mets:div TYPE="Copy"><mets:fptr><mets:seq>
+<mets:area FILEID="alto00001" BEGIN="P1_TB00003"/>
+<mets:area FILEID="alto00002" BEGIN="P2_TB00001"/>
+</mets:seq></mets:fptr></mets:div>
+</mets:div>
+<mets:div TYPE="TextContent" DMDID="c002">
+<mets:div TYPE="Head"><mets:fptr>
+<mets:area FILEID="alto00002" BEGIN="P2_TB00002"/></mets:fptr></mets:div>
+</mets:div>
+<mets:div TYPE="TextContent" DMDID="c003">
+<mets:div TYPE="Subhead"/>
+<mets:div TYPE="Copy"><mets:fptr>
+<mets:area FILEID="alto00002" BEGIN="P2_TB00003"/></mets:fptr></mets:div>
+</mets:div>
+<mets:div TYPE="TextContent" DMDID="c004">
+<mets:div TYPE="Copy"><mets:fptr>
+<mets:area FILEID="alto00002" BEGIN="P2_TB00004"/></mets:fptr></mets:div>
+</mets:div>
+<mets:div TYPE="TextContent" DMDID="c004">
+<mets:div TYPE="Copy"><mets:fptr>
+<mets:area FILEID="alto00002" BEGIN="P2_TB00009"/></mets:fptr></mets:div>
+</mets:div>
+<mets:div TYPE="Illustration" DMDID="c005"/>
+<mets:div TYPE="SponsoredAd" DMDID="c006">
+<mets:div TYPE="Copy"><mets:fptr>
+<mets:area FILEID="alto00002" BEGIN="P2_TB00005"/></mets:fptr></mets:div>
+</mets:div>
+</mets:div>
+</mets:structMap>
+</mets:mets>
+'''
+
+
+class Test_mets(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'issue.mets.xml')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _parse(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        diagnostics.reset()
+        expected = mets.main(self.path)
+        expected_report = diagnostics.report()
+        self.assertIn('ignored_section', expected_report)
+        diagnostics.reset()
+        result = mets.main(self.path, engine='lxml')
+        self.assertEqual(result, expected)
+        self.assertEqual(diagnostics.report(), expected_report)
+        return result
+
+    def test_engines_equal(self):
+        result = self._parse(METS_ISSUE)
+        self.assertEqual((result.volume, result.number, result.date),
+                         ('1', '3', '1910-03-17'))
+        sections = {s.section_id: s for s in result.sections}
+        self.assertEqual(sorted(sections), ['c001', 'c002', 'c003', 'c004',
+                                            'c005', 'c006'])
+        self.assertEqual(sections['c001'].title, 'Der Sturm Gedicht')
+        self.assertEqual(sections['c001'].authors, 'HERWARTH WALDEN')
+        # subsections have the authors of the parent
+        self.assertEqual(sections['c004'].authors, 'August Stramm')
+        self.assertEqual(sections['c004'].subsections['Copy'],
+                         [records.Location('alto00002', 'P2_TB00004')])
+        self.assertEqual(len(sections['c001'].subsections['Copy']), 2)
+
+    def test_engines_errors(self):
+        content = METS_ISSUE.replace('"SponsoredAd"', '"TextContent"')
+        for engine in mets.ENGINES:
+            with self.assertRaisesRegex(MyError, 'c006 .* text content'):
+                with open(self.path, 'w') as f:
+                    f.write(content)
+                mets.main(self.path, engine=engine)
+        content = METS_ISSUE.replace('"Subhead"', '"Footnote"')
+        for engine in mets.ENGINES:
+            with self.assertRaisesRegex(MyError, 'Footnote'):
+                mets.main(self.path, content.encode(), engine)
+
+
+class Test_diagnostics(unittest.TestCase):
+
+    def setUp(self):
+        diagnostics.reset()
+
+    def tearDown(self):
+        diagnostics.configure()
+        diagnostics.reset()
+
+    def test_report(self):
+        diagnostics.configure(max_records=2)
+        for name in ['a', 'b', 'a', 'c']:
+            diagnostics.record('missing', 'name "{}" missing', name)
+        diagnostics.record_many('pairs', '{} and {}', [(1, 2), (1, 2)])
+        report = diagnostics.report()
+        # "c" is only counted, there are already two different records
+        self.assertEqual(report['missing'], {
+            'count': 4, 'distinct': 2,
+            'records': [['name "a" missing', 2], ['name "b" missing', 1]]})
+        self.assertEqual(report['pairs']['records'], [['1 and 2', 2]])
+        self.assertEqual(diagnostics.count('missing'), 4)
+        self.assertEqual(diagnostics.count('other'), 0)
+
+    def test_quiet(self):
+        diagnostics.configure(quiet=True)
+        diagnostics.record('missing', 'name "{}" missing', 'a')
+        diagnostics.record_many('missing', 'name "{}" missing', ['b', 'c'])
+        self.assertEqual(diagnostics.report()['missing'],
+                         {'count': 3, 'distinct': 0, 'records': []})
+
+    def test_merge(self):
+        diagnostics.record('missing', 'name "{}" missing', 'a')
+        data = diagnostics.collect()
+        self.assertEqual(diagnostics.report(), {})
+        diagnostics.record('missing', 'name "{}" missing', 'a')
+        diagnostics.merge(data)
+        self.assertEqual(diagnostics.report()['missing']['records'],
+                         [['name "a" missing', 2]])
+
+    def test_summarized(self):
+        diagnostics.record('missing', 'name "{}" missing', 'a')
+        diagnostics.record('other', 'other')
+        with self.assertLogs(diagnostics.logger, 'WARNING') as logs:
+            with diagnostics.summarized():
+                diagnostics.record('missing', 'name "{}" missing', 'a')
+        # only the records of the block
+        self.assertEqual(logs.output, [
+            'WARNING:bmt_parser.diagnostics:missing: 1 records, '
+            'e.g. name "a" missing'])
+
+    def test_summary_of_entry_points(self):
+        # the problems are logged without the command line
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = synthetic.generate(tmp, issues=2, sections=5, pages=1,
+                                       blocks=5, authors=10, missing=0.5)
+            issue_dir = os.path.join(paths['issues'], '1910', '00002')
+            for name in os.listdir(issue_dir):
+                if name.endswith('mets.xml'):
+                    os.remove(os.path.join(issue_dir, name))
+            data_path = os.path.join(tmp, 'data.csv')
+            with self.assertLogs(diagnostics.logger, 'WARNING') as logs:
+                parse_xml.main(paths['issues'], data_path)
+                disamb.main(paths['disambiguation'], data_path, None)
+        categories = [line.split(':')[2] for line in logs.output]
+        self.assertIn('no_mets_file', categories)
+        self.assertIn('name_not_in_disambiguation', categories)
+
+
+class Test_records(unittest.TestCase):
+
+    def test_section(self):
+        issue = records.Issue('1910-03-17', '1', '3')
+        issue.issue_id = 7
+        section = records.Section('c001', 'Gedicht', None, 'text',
+                                  {'Head': None})
+        section.issue = issue
+        section.texts = {'Copy': 'Text'}
+        self.assertEqual(section.row(['issue_id', 'date', 'section_id',
+                                      'authors', 'section_type', 'Head',
+                                      'Copy']),
+                         (7, '1910-03-17', 'c001', '', '', '', 'Text'))
+        # a section without names has no authors
+        self.assertIsNone(section.authors)
+        self.assertIsNone(section.get('authors', None))
+
+    def test_pickle(self):
+        issue = records.Issue('1910-03-17', '1', '3')
+        sections = [records.Section('c00{}'.format(i), 'Gedicht',
+                                    ''.join(['Herwarth ', 'Walden']), 'text')
+                    for i in range(2)]
+        for section in sections:
+            section.issue = issue
+        result = pickle.loads(pickle.dumps(sections))
+        self.assertEqual(result, sections)
+        # the issue is shared and the authors are interned
+        self.assertIs(result[0].issue, result[1].issue)
+        self.assertIs(result[0].authors, result[1].authors)
+        self.assertIs(result[0].authors, sys.intern('Herwarth Walden'))
+
+
+class Test_alto(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'bmtnaap_1910-03_01_0001.xml')
+        with open(self.path, 'w') as f:
+            f.write(ALTO_PAGE)
+        self.locations = ['P1_TB00002', 'P1_TB00001', 'P1_TB00003']
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_engines_equal(self):
+        root = alto._get_alto_xml('alto00001', self.dir.name)
+        expected = {loc: alto._get_text_from_alto(root, loc)
+                    for loc in self.locations}
+        result = alto._get_texts_iterparse(self.path, self.locations)
+        self.assertEqual(result, expected)
+        self.assertEqual(result['P1_TB00002'],
+                         'Wochenschrift für    Kultur')
+
+    def test_iterparse_missing_block(self):
+        with self.assertRaises(MyError):
+            alto._get_texts_iterparse(self.path, ['P1_TB00001', 'P1_TB00009'])
+
+
+class Test_parse(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.paths = synthetic.generate(cls.dir.name, issues=3, sections=10,
+                                       pages=3, blocks=20, authors=20)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def _parse(self, **kwargs):
+        path = os.path.join(self.dir.name, 'data.csv')
+        parse_xml.main(self.paths['issues'], path, **kwargs)
+        with open(path) as f:
+            return f.read()
+
+    def test_synthetic_data(self):
+        data = parse_xml.get_data(self.paths['issues'])
+        self.assertEqual(len(data), 3 * 12)  # one parent with 2 subsections
+        self.assertEqual(list(data.columns), parse_xml.columns)
+        self.assertEqual(sorted(set(data.issue_id)), [1, 2, 3])
+        self.assertTrue(data.Copy.notnull().any())
+
+    def test_metrics(self):
+        metrics.reset()
+        parse_xml.main(self.paths['issues'],
+                       os.path.join(self.dir.name, 'data.csv'), workers=2)
+        report = metrics.report(slowest=2)
+        self.assertEqual(report['counts']['issues'], 3)
+        self.assertEqual(report['counts']['sections'], 3 * 12)
+        self.assertGreater(report['counts']['bytes_read'], 0)
+        self.assertIn('parse_alto', report['stages'])
+        self.assertEqual(len(report['slowest_issues']), 2)
+
+    def test_same_output(self):
+        expected = self._parse()
+        self.assertEqual(self._parse(alto_engine='lxml'), expected)
+
+    def test_workers(self):
+        # a process pool gives the same output as parsing in one process,
+        # also with more workers than issues
+        expected = self._parse()
+        for workers in [2, 4]:
+            self.assertEqual(self._parse(workers=workers), expected)
+
+    def test_read_ahead(self):
+        expected = self._parse()
+        self.assertEqual(self._parse(read_ahead=2), expected)
+        # one issue is read even if it is larger than the limit
+        self.assertEqual(self._parse(read_ahead=2, read_ahead_bytes=1),
+                         expected)
+
+        tasks = parse_xml._get_tasks(self.paths['issues'], 'bs4')
+        issues = prefetch.read_ahead(tasks, depth=1)
+        task, files = next(issues)
+        self.assertEqual(task, tasks[0])
+        with open(task[0], 'rb') as f:
+            self.assertEqual(files['mets'], f.read())
+        self.assertEqual(sorted(files['alto']), sorted(os.listdir(task[1])))
+        self.assertEqual(len(list(issues)), 2)
+
+    def test_read_ahead_bytes(self):
+        # the sizes of the issues that are read count against max_bytes
+        # before their files are read
+        tasks = parse_xml._get_tasks(self.paths['issues'], 'bs4')
+        for max_bytes, taken in [(1, 2), (2**30, 3)]:
+            listed = []
+            issues = prefetch.read_ahead(
+                (listed.append(task) or task for task in tasks), depth=2,
+                max_bytes=max_bytes)
+            next(issues)
+            # with max_bytes=1, the second issue is listed but not read
+            self.assertEqual(len(listed), taken)
+            issues.close()
+
+    def _broken_issues(self, name):
+        '''returns a copy of the issues dir whose second mets file is a
+        dangling symlink, and the path of that mets file
+        '''
+        issues = os.path.join(self.dir.name, name)
+        shutil.copytree(self.paths['issues'], issues)
+        mets_path = parse_xml.find_issues(issues)[1][0]
+        os.remove(mets_path)
+        os.symlink(mets_path + '.missing', mets_path)
+        return issues, mets_path
+
+    def test_read_ahead_error(self):
+        # an issue whose files cannot be read is logged and skipped
+        issues, mets_path = self._broken_issues('broken')
+        path = os.path.join(self.dir.name, 'data.csv')
+        outputs = []
+        for read_ahead in [0, 2]:
+            with self.assertLogs(parse_xml.logger, 'ERROR') as logs:
+                parse_xml.main(issues, path, read_ahead=read_ahead)
+            self.assertIn(mets_path, logs.output[0])
+            with open(path) as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        with self.assertLogs(parse_xml.logger, 'ERROR'):
+            data = parse_xml.get_data(issues, read_ahead=2)
+        self.assertEqual(sorted(set(data.issue_id)), [1, 3])
+
+    def test_cache_errors(self):
+        issues, mets_path = self._broken_issues('broken_cached')
+        cache_dir = os.path.join(self.dir.name, 'cache')
+        for _ in range(2):
+            with self.assertLogs(parse_xml.logger, 'ERROR') as logs:
+                data = parse_xml.get_data(issues, cache_dir=cache_dir)
+            self.assertIn(mets_path, logs.output[0])
+            self.assertEqual(sorted(set(data.issue_id)), [1, 3])
+
+        # an entry with a valid header and broken sections is parsed again
+        first = parse_xml.find_issues(issues)[0][0]
+        with open(cache._entry_path(cache_dir, first), 'r+b') as f:
+            pickle.load(f)
+            f.truncate()
+        with self.assertLogs(parse_xml.logger, 'ERROR'):
+            cached = parse_xml.get_data(issues, cache_dir=cache_dir)
+        self.assertTrue(cached.equals(data))
+
+    def test_archives(self):
+        expected = parse_xml.get_data(self.paths['issues'])
+        expected = expected.set_index(['date', 'section_id']).sort_index()
+        for fmt in ['zip', 'tar', 'gztar']:
+            path = shutil.make_archive(
+                os.path.join(self.dir.name, 'issues'), fmt,
+                os.path.dirname(self.paths['issues']), 'issues')
+            self.assertTrue(archive.is_archive(path))
+            self.assertEqual(len(parse_xml.find_issues(path)), 3)
+
+            for workers in [1, 2]:
+                data = parse_xml.get_data(path, workers=workers)
+                data = data.set_index(['date', 'section_id']).sort_index()
+                pd.testing.assert_frame_equal(
+                    data.drop(columns='issue_id'),
+                    expected.drop(columns='issue_id'))
+
+            refs = parse_xml.get_data(path, text_mode='references')
+            self.assertTrue(refs.alto_dir[0].startswith(path))
+            loaded = parse_xml.load_text(refs)
+            self.assertEqual(sorted(loaded.Copy.dropna()),
+                             sorted(expected.Copy.dropna()))
+
+    def test_iter_sections(self):
+        data = parse_xml.get_data(self.paths['issues'])
+        sections = parse_xml.iter_sections(self.paths['issues'], workers=2)
+        first = next(sections)
+        self.assertEqual(list(first.keys()), parse_xml.columns)
+        self.assertEqual(first['issue_id'], 1)
+        self.assertEqual(1 + len(list(sections)), len(data))
+
+        issues = parse_xml.iter_issues(self.paths['issues'])
+        self.assertEqual([len(issue) for issue in issues], [12, 12, 12])
+
+    def test_references(self):
+        data = parse_xml.get_data(self.paths['issues'])
+        refs = parse_xml.get_data(self.paths['issues'],
+                                  text_mode='references')
+        self.assertEqual(list(refs.columns), parse_xml.reference_columns)
+        self.assertEqual(alto.parse_references(refs.Copy.dropna().iloc[0])[0],
+                         ('alto00001', 'P1_TB00003'))
+
+        for engine in alto.ENGINES:
+            loaded = parse_xml.load_text(refs, alto_engine=engine)
+            pd.testing.assert_frame_equal(loaded[parse_xml.columns], data)
+
+        row = refs.dropna(subset=['Copy']).iloc[-1]
+        self.assertEqual(alto.get_text(row.Copy, row.alto_dir),
+                         data.loc[row.name, 'Copy'])
+
+
+class Test_alto_index(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        for page in range(1, 13):
+            name = 'bmtnaap_1910-03_01_{:04d}.alto.xml'.format(page)
+            open(os.path.join(self.dir.name, name), 'w').close()
+        self.index = alto._index_alto_dir(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_find(self):
+        for fileid, page in [('alto00001', '0001'), ('alto00010', '0010')]:
+            path = alto._find_alto_file(fileid, self.dir.name, self.index)
+            self.assertEqual(os.path.basename(path),
+                             'bmtnaap_1910-03_01_{}.alto.xml'.format(page))
+
+    def test_errors(self):
+        with self.assertRaisesRegex(MyError, 'not found'):
+            alto._find_alto_file('alto00013', self.dir.name, self.index)
+        # not a page number, falls back to searching the file names
+        with self.assertRaisesRegex(MyError, 'multiple files'):
+            alto._find_alto_file('alto0001', self.dir.name, self.index)
+        open(os.path.join(self.dir.name, 'copy_0002.xml'), 'w').close()
+        with self.assertRaisesRegex(MyError, 'multiple files'):
+            alto._find_alto_file('alto00002', self.dir.name)
+
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class Test_cli(unittest.TestCase):
+
+    def test_subcommands(self):
+        parser = cli.get_parser()
+        args = parser.parse_args(['parse', '-xml', 'data', '-w', '2'])
+        self.assertEqual((args.command, args.xml_data_path, args.workers),
+                         ('parse', 'data', 2))
+        args = parser.parse_args(['run', '-d', 'disamb.csv', '-graph'])
+        self.assertIsNone(args.xml_data_path)
+        self.assertTrue(args.tf_for_graph)
+        # the disambiguation file is required
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            parser.parse_args(['disambiguate'])
+
+    def test_lazy_imports(self):
+        # the command line is imported without the stage modules
+        code = ('import sys, bmt_parser.cli; '
+                'print(sorted(m for m in ["pandas", "bs4", "lxml"] '
+                'if m in sys.modules))')
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), '[]')
+        # the parse subcommand does not import pandas
+        code = ('import sys, bmt_parser.parse_xml; '
+                'print(sorted(m for m in ["pandas", "pyarrow"] '
+                'if m in sys.modules))')
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_configure_logging(self):
+        # the modules have no handlers, the package logger gets them once
+        self.assertEqual(parse_xml.logger.handlers, [])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'parse.log')
+            package_logger = logging.getLogger('bmt_parser')
+            handlers = list(package_logger.handlers)
+            try:
+                package_logger.handlers = []
+                cli.configure_logging(path)
+                cli.configure_logging(path)
+                self.assertEqual(len(package_logger.handlers), 2)
+                parse_xml.logger.warning('logged once')
+                package_logger.handlers[1].close()
+                with open(path) as f:
+                    self.assertEqual(f.read(), 'logged once\n')
+            finally:
+                package_logger.handlers = handlers
+
+    def test_in_memory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = synthetic.generate(tmp, issues=3, sections=10, pages=2,
+                                       blocks=10, authors=10)
+            output_dir = cf.OUTPUT_DIR
+            outputs = {}
+            try:
+                for mode in [[], ['-mem'], ['-mem', '--write_intermediate']]:
+                    cf.OUTPUT_DIR = os.path.join(tmp, 'output', *mode)
+                    cli.main(['run', '-xml', paths['issues'], '-d',
+                              paths['disambiguation'], '-graph'] + mode)
+                    outputs[tuple(mode)] = {
+                        name: self._read(os.path.join(cf.OUTPUT_DIR, name))
+                        for name in os.listdir(cf.OUTPUT_DIR)}
+            finally:
+                cf.OUTPUT_DIR = output_dir
+
+        files = outputs[()]
+        # in memory, the data files are only written if asked
+        self.assertEqual(list(outputs[('-mem',)]), ['collaborators.csv'])
+        self.assertEqual(outputs[('-mem',)]['collaborators.csv'],
+                         files['collaborators.csv'])
+        self.assertEqual(outputs[('-mem', '--write_intermediate')], files)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class Test_storage(unittest.TestCase):
+
+    rows = [{'issue_id': 1, 'authors': 'a||b', 'Copy': 'text'},
+            {'issue_id': 2, 'authors': '', 'Copy': None}]
+
+    def _roundtrip(self, fmt):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = storage.output_path(os.path.join(tmp, 'data.csv'), fmt)
+            with storage.TableWriter(path, ['issue_id', 'authors', 'Copy'],
+                                     fmt, batch_size=1) as writer:
+                writer.write_rows(self.rows)
+            all_columns = storage.read(path, fmt)
+            some_columns = storage.read(path, fmt, ['issue_id', 'authors'])
+        self.assertEqual(list(all_columns['issue_id']), [1, 2])
+        self.assertEqual(all_columns['authors'][0], 'a||b')
+        # empty strings are missing values in all formats
+        self.assertTrue(pd.isnull(all_columns['authors'][1]))
+        self.assertTrue(pd.isnull(all_columns['Copy'][1]))
+        self.assertEqual(list(some_columns.columns), ['issue_id', 'authors'])
+
+    def test_csv(self):
+        self._roundtrip('csv')
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_columnar(self):
+        self._roundtrip('parquet')
+        self._roundtrip('feather')
+
+
+class Test_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, 'cache')
+        self.alto_dir = os.path.join(self.dir.name, 'alto')
+        os.makedirs(self.alto_dir)
+        self.mets_path = os.path.join(self.dir.name, 'issue.mets.xml')
+        for path in [self.mets_path, os.path.join(self.alto_dir, '1.xml')]:
+            with open(path, 'w') as f:
+                f.write('<xml/>')
+        self.sections = [{'section_id': 'c001', 'issue_id': 1}]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_hit(self):
+        sig = cache.signature(self.mets_path, self.alto_dir)
+        cache.put(self.cache_dir, self.mets_path, sig, self.sections)
+        sig = cache.signature(self.mets_path, self.alto_dir)
+        self.assertTrue(cache.is_valid(self.cache_dir, self.mets_path, sig))
+        self.assertEqual(cache.get(self.cache_dir, self.mets_path, sig),
+                         self.sections)
+
+    def test_unreadable(self):
+        os.remove(self.mets_path)
+        sig = cache.signature(self.mets_path, self.alto_dir)
+        self.assertIsNone(sig)
+        self.assertFalse(cache.is_valid(self.cache_dir, self.mets_path, sig))
+
+    def test_changed_file(self):
+        sig = cache.signature(self.mets_path, self.alto_dir, hash_files=True)
+        cache.put(self.cache_dir, self.mets_path, sig, self.sections)
+        with open(os.path.join(self.alto_dir, '1.xml'), 'w') as f:
+            f.write('<xml></xml>')
+        sig = cache.signature(self.mets_path, self.alto_dir, hash_files=True)
+        self.assertFalse(cache.is_valid(self.cache_dir, self.mets_path, sig))
+        self.assertIsNone(cache.get(self.cache_dir, self.mets_path, sig))
+
+    def test_clear(self):
+        sig = cache.signature(self.mets_path, self.alto_dir)
+        cache.put(self.cache_dir, self.mets_path, sig, self.sections)
+        cache.clear(self.cache_dir)
+        self.assertIsNone(cache.get(self.cache_dir, self.mets_path, sig))